@@ -1,4 +1,6 @@
 from django.contrib import admin
-from activities.models import Swipe
+from activities.models import Swipe, Match, SwipeCounter
 
 admin.site.register(Swipe)
+admin.site.register(Match)
+admin.site.register(SwipeCounter)
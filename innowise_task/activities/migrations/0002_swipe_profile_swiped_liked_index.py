@@ -0,0 +1,17 @@
+# Generated by Django 3.1.6 on 2026-10-18 10:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activities', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='swipe',
+            index=models.Index(fields=['profile', 'swiped', 'liked'], name='activities__profile_57d69e_idx'),
+        ),
+    ]
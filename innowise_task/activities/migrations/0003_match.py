@@ -0,0 +1,47 @@
+# Generated by Django 3.1.6 on 2026-10-18 10:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_matches(apps, schema_editor):
+    Swipe = apps.get_model('activities', 'Swipe')
+    Match = apps.get_model('activities', 'Match')
+    liked_back = Swipe.objects.filter(
+        liked=True,
+        profile=models.OuterRef('swiped'),
+        swiped=models.OuterRef('profile')
+    )
+    likes = Swipe.objects\
+        .filter(liked=True)\
+        .filter(models.Exists(liked_back))\
+        .values_list('profile_id', 'swiped_id')
+    Match.objects.bulk_create([
+        Match(profile_id=profile_id, matched_id=matched_id)
+        for profile_id, matched_id in likes.iterator()
+    ], batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_geocodedlocation'),
+        ('activities', '0002_swipe_profile_swiped_liked_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Match',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateTimeField(auto_now_add=True)),
+                ('matched', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='app.profile')),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='matches', to='app.profile')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='match',
+            constraint=models.UniqueConstraint(fields=('profile', 'matched'), name='unique_match'),
+        ),
+        migrations.RunPython(create_matches, migrations.RunPython.noop),
+    ]
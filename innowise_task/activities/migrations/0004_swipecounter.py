@@ -0,0 +1,44 @@
+# Generated by Django 3.1.6 on 2026-10-18 10:26
+
+from django.db import migrations, models
+from django.utils import timezone
+import django.db.models.deletion
+
+
+def count_today_swipes(apps, schema_editor):
+    Swipe = apps.get_model('activities', 'Swipe')
+    SwipeCounter = apps.get_model('activities', 'SwipeCounter')
+    today = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    counts = Swipe.objects\
+        .filter(date__gte=today)\
+        .values('profile_id')\
+        .annotate(count=models.Count('id'))
+    SwipeCounter.objects.bulk_create([
+        SwipeCounter(profile_id=row['profile_id'], day=today.date(), count=row['count'])
+        for row in counts
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_geocodedlocation'),
+        ('activities', '0003_match'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SwipeCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='swipe_counters', to='app.profile')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='swipecounter',
+            constraint=models.UniqueConstraint(fields=('profile', 'day'), name='unique_swipe_counter'),
+        ),
+        migrations.RunPython(count_today_swipes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.1.6 on 2026-10-18 10:27
+
+from django.db import migrations, models
+
+
+def remove_repeated_swipes(apps, schema_editor):
+    Swipe = apps.get_model('activities', 'Swipe')
+    first_swipes = Swipe.objects\
+        .values('profile_id', 'swiped_id')\
+        .annotate(first_id=models.Min('id'), count=models.Count('id'))\
+        .filter(count__gt=1)
+    for row in first_swipes:
+        Swipe.objects\
+            .filter(profile_id=row['profile_id'], swiped_id=row['swiped_id'])\
+            .exclude(id=row['first_id'])\
+            .delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activities', '0004_swipecounter'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_repeated_swipes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='swipe',
+            constraint=models.UniqueConstraint(fields=('profile', 'swiped'), name='unique_swipe'),
+        ),
+    ]
@@ -1,5 +1,8 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import Q, F
+from django.utils import timezone
 from app.models import Profile
+from app.services import invalidate_matches
 
 class Swipe(models.Model):
     date = models.DateTimeField(auto_now_add=True)
@@ -17,6 +20,14 @@ class Swipe(models.Model):
         related_name='swiped',
     )
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['profile', 'swiped'], name='unique_swipe'),
+        ]
+        indexes = [
+            models.Index(fields=['profile', 'swiped', 'liked']),
+        ]
+
     def __str__(self):
         return '{} {} swiped {} {}, liked: {}'.format(
             self.profile.fname, self.profile.lname,
@@ -24,4 +35,149 @@ class Swipe(models.Model):
             self.liked
             )
 
-    
\ No newline at end of file
+    def save(self, *args, counted=False, liked_back=None, **kwargs):
+        '''
+            Save swipe along with the match of the profiles and count it
+            to the daily swipes, match is created when the like is reciprocal
+            and removed when the like is withdrawn
+            Swipe already counted and the reciprocal like already known
+            are passed with counted and liked_back to skip their queries
+        '''
+        adding = self._state.adding
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+            if adding and not counted:
+                SwipeCounter.objects.increment(self.profile_id)
+            if liked_back is None:
+                liked_back = Swipe.objects.filter(
+                    profile_id=self.swiped_id,
+                    swiped_id=self.profile_id,
+                    liked=True
+                ).exists()
+            self.is_match = self.liked and liked_back
+            if self.is_match:
+                Match.objects.create_pair(self.profile_id, self.swiped_id)
+            elif not adding:
+                Match.objects.remove_pair(self.profile_id, self.swiped_id)
+
+    def delete(self, *args, **kwargs):
+        '''Remove match of the profiles along with the like'''
+        with transaction.atomic(savepoint=False):
+            if self.liked:
+                Match.objects.remove_pair(self.profile_id, self.swiped_id)
+            return super().delete(*args, **kwargs)
+
+class MatchManager(models.Manager):
+
+    def create_pair(self, profile_id, matched_id):
+        '''Create match records for both profiles'''
+        self.create_pairs(profile_id, [matched_id])
+
+    def create_pairs(self, profile_id, matched_ids):
+        '''Create match records of the profile with every matched profile'''
+        matches = []
+        for matched_id in matched_ids:
+            matches.append(Match(profile_id=profile_id, matched_id=matched_id))
+            matches.append(Match(profile_id=matched_id, matched_id=profile_id))
+        self.bulk_create(matches, ignore_conflicts=True)
+        invalidate_matches((profile_id, matched_id) for matched_id in matched_ids)
+
+    def remove_pair(self, profile_id, matched_id):
+        '''Remove match records of both profiles'''
+        self.filter(
+            Q(profile_id=profile_id, matched_id=matched_id) |
+            Q(profile_id=matched_id, matched_id=profile_id)
+        ).delete()
+        invalidate_matches([(profile_id, matched_id)])
+
+class Match(models.Model):
+    '''Mutual like of two profiles, stored once for each of them'''
+    date = models.DateTimeField(auto_now_add=True)
+
+    profile = models.ForeignKey(
+        Profile,
+        on_delete=models.CASCADE,
+        related_name='matches',
+    )
+
+    matched = models.ForeignKey(
+        Profile,
+        on_delete=models.CASCADE,
+        related_name='+',
+    )
+
+    objects = MatchManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['profile', 'matched'], name='unique_match'),
+        ]
+
+    def __str__(self):
+        return '{} {} matched {} {}'.format(
+            self.profile.fname, self.profile.lname,
+            self.matched.fname, self.matched.lname
+            )
+
+class SwipeCounterManager(models.Manager):
+
+    def increment(self, profile_id, count=1):
+        '''Add swipes to today's counter of the profile'''
+        day = timezone.now().date()
+        if self.filter(profile_id=profile_id, day=day).update(count=F('count') + count):
+            return
+        try:
+            with transaction.atomic():
+                self.create(profile_id=profile_id, day=day, count=count)
+        except IntegrityError:
+            self.filter(profile_id=profile_id, day=day).update(count=F('count') + count)
+
+    def take(self, profile_id, limit) -> bool:
+        '''
+            Count one more swipe of the profile if today's counter is under the limit,
+            the counter stays locked until the end of the transaction
+            Counter is checked and incremented by one query once it is created
+        '''
+        day = timezone.now().date()
+        if self.filter(profile_id=profile_id, day=day, count__lt=limit).update(count=F('count') + 1):
+            return True
+        counter = self.get_locked(profile_id)
+        if counter.count >= limit:
+            return False
+        self.filter(id=counter.id).update(count=F('count') + 1)
+        return True
+
+    def get_locked(self, profile_id):
+        '''
+            Get today's counter of the profile locked until the end of the transaction,
+            so concurrent swipes of the profile check the quota one by one
+        '''
+        counter, created = self.select_for_update().get_or_create(
+            profile_id=profile_id,
+            day=timezone.now().date()
+        )
+        return counter
+
+class SwipeCounter(models.Model):
+    '''Number of swipes the profile made during the day, UTC'''
+    day = models.DateField()
+    count = models.PositiveIntegerField(default=0)
+
+    profile = models.ForeignKey(
+        Profile,
+        on_delete=models.CASCADE,
+        related_name='swipe_counters',
+    )
+
+    objects = SwipeCounterManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['profile', 'day'], name='unique_swipe_counter'),
+        ]
+
+    def __str__(self):
+        return '{} {} made {} swipes on {}'.format(
+            self.profile.fname, self.profile.lname,
+            self.count, self.day
+            )
@@ -1,10 +1,13 @@
 from rest_framework import serializers
 
 from app.models import Profile
+from app.serializers import NestedProfileSerializer
 from activities.models import Swipe
 
 class SwipeSerializer(serializers.ModelSerializer):
-       
+    profile = NestedProfileSerializer(read_only=True)
+    swiped = NestedProfileSerializer(read_only=True)
+
     class Meta:
         model = Swipe
         fields = ('date', 'liked', 'profile', 'swiped')
@@ -12,5 +15,8 @@ class SwipeSerializer(serializers.ModelSerializer):
         extra_kwargs = {
             'liked':{'required':True}
         }
-        depth = 1
 
+
+class SwipeBatchSerializer(serializers.Serializer):
+    swiped = serializers.IntegerField()
+    liked = serializers.BooleanField()
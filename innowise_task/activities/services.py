@@ -1,40 +1,105 @@
-from datetime import datetime, timedelta
-
+from django.db.models import Exists, OuterRef
 from django.db.models.query import QuerySet
 from django.conf import settings
 
 from app.models import Profile
-from activities.models import Swipe
+from activities.models import Swipe, Match, SwipeCounter
+from chat.models import Chat
 
 def get_matches(request) -> QuerySet:
     '''
         Get matches for current user, check if current user was liked by another 
-        and filter swipes by getting profiles liked by the user
+        and filter swipes by profiles matched with the user
     '''
-    profile = Profile.objects.get(user=request.user)
-    liked = Swipe.objects.filter(liked=True, profile=profile)
-    profiles: list = [like.swiped for like in  liked]
-    matches = Swipe.objects.filter(liked=True, swiped=profile, profile__in=profiles)
+    profile = request.profile
+    matches = Swipe.objects\
+        .filter(liked=True, swiped=profile, profile__matches__matched=profile)\
+        .select_related('profile', 'swiped')
     return matches
 
-def is_swipe_available(profile) -> bool:
+def get_swipe_limit(profile) -> int:
+    '''Get number of swipes user subscription allows to make a day'''
+    return settings.VIP_SUBSCRIBTION_SWIPES if profile.vip else settings.BASIC_SUBSCRIPTION_SWIPES
+
+def take_swipe(profile) -> bool:
+    '''
+        Check if user subscription allows it to make one more swipe and count it
+        to today's swipes counter, the counter stays locked until the end
+        of the transaction the swipe is taken in
+    '''
+    return SwipeCounter.objects.take(profile.id, get_swipe_limit(profile))
+
+def lock_profiles(profile_ids) -> set:
+    '''
+        Lock profiles until the end of the transaction in the order of their ids
+        and get ids of the found ones, so swipes between the same profiles
+        are made one by one and reciprocal likes always see each other
+    '''
+    return set(Profile.objects\
+        .select_for_update()\
+        .filter(id__in=profile_ids)\
+        .order_by('id')\
+        .values_list('id', flat=True))
+
+def get_swiped_profile(profile, swiped_id):
+    '''
+        Get profile the user swipes or None if it is not found, along with
+        "liked_back" if it liked the user and "already_swiped" by the user
+    '''
+    return Profile.objects\
+        .filter(id=swiped_id)\
+        .annotate(
+            liked_back=Exists(Swipe.objects.filter(profile_id=OuterRef('pk'), swiped_id=profile.id, liked=True)),
+            already_swiped=Exists(Swipe.objects.filter(profile_id=profile.id, swiped_id=OuterRef('pk')))
+        )\
+        .first()
+
+
+def create_swipes(profile, swipes) -> list:
     '''
-        Check if user subscription allows it to make one more swipe
-        by getting an amount of today's swipes
+        Create swipes of the user in bulk, must be called in a transaction
+        Quota is checked once for all the swipes, repeated swipes are found
+        with one query, swipes are inserted with one query, matches and chats
+        are created for reciprocal likes
+        Swiped profiles are locked along with the user's one before the counter,
+        in the same order as single swipes lock them
+        Return result for every swipe in the order they are given
     '''
-    swipe_count_available = settings.VIP_SUBSCRIBTION_SWIPES if profile.vip else settings.BASIC_SUBSCRIPTION_SWIPES
-    return Swipe.objects.filter(
-        date__contains=datetime.strftime(datetime.today(), '%Y-%m-%d'),
-        profile=profile
-        ).count() < swipe_count_available
+    ids = {swipe['swiped'] for swipe in swipes}
+    found = lock_profiles(ids | {profile.id}) & ids
+    swipe_count_available = get_swipe_limit(profile) - SwipeCounter.objects.get_locked(profile.id).count
+    swiped = set(profile.swipes.filter(swiped_id__in=ids).values_list('swiped_id', flat=True))
 
-def is_already_swiped(profile, swiped) -> bool:
-    '''Check if user already swiped this profile'''
-    return len(profile.swipes.filter(swiped=swiped)) != 0
+    results, new_swipes = [], []
+    for swipe in swipes:
+        result = {'swiped': swipe['swiped'], 'created': False, 'match': False, 'chat': None}
+        if swipe['swiped'] not in found:
+            result['detail'] = 'profile is not found'
+        elif swipe['swiped'] == profile.id:
+            result['detail'] = 'user can\'t swipe its own profile'
+        elif swipe['swiped'] in swiped:
+            result['detail'] = 'user have already swiped this profile'
+        elif len(new_swipes) >= swipe_count_available:
+            result['detail'] = 'swipes limit is exceeded for today'
+        else:
+            swiped.add(swipe['swiped'])
+            new_swipes.append(Swipe(profile=profile, swiped_id=swipe['swiped'], liked=swipe['liked']))
+            result['created'] = True
+        results.append(result)
+    if len(new_swipes) == 0:
+        return results
 
-def is_match(profile, swiped, liked) -> bool:
-    '''Check if users are matched'''
-    if not liked:
-        return False
-    return len(swiped.swipes.filter(swiped=profile, liked=True)) != 0
+    Swipe.objects.bulk_create(new_swipes)
+    SwipeCounter.objects.increment(profile.id, len(new_swipes))
 
+    liked = [swipe.swiped_id for swipe in new_swipes if swipe.liked]
+    matched = set(Swipe.objects\
+        .filter(liked=True, swiped=profile, profile_id__in=liked)\
+        .values_list('profile_id', flat=True))
+    if matched:
+        Match.objects.create_pairs(profile.id, matched)
+        chats = Chat.objects.get_pairs(profile.id, matched)
+        for result in results:
+            if result['created'] and result['swiped'] in matched:
+                result['match'], result['chat'] = True, chats[result['swiped']].id
+    return results
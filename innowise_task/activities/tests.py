@@ -1,9 +1,13 @@
 import random
 
+from datetime import timedelta
+from django.utils import timezone
 from django.urls import reverse
 from django.contrib.auth.models import User
 from django.test import TestCase
 from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APIClient
 from pytest_factoryboy import register
 from factory.django import DjangoModelFactory
@@ -11,7 +15,8 @@ from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
 
 from app.tests import ProfileFactory, UserFactory, LocationFactory
 from app.models import Profile, Location, Images
-from activities.models import Swipe
+from activities.models import Swipe, Match, SwipeCounter
+from chat.models import Chat
 
 import factory
 import pytest
@@ -95,6 +100,23 @@ def test_already_swiped_user(auth_client):
     
     assert response_repeat.status_code == 400
     assert response_repeat.data['detail'] == 'user have already swiped this profile'
+
+@pytest.mark.django_db
+def test_self_swipe(auth_client):
+    '''Test whether user can't swipe its own profile alone or in the batch'''
+    url = reverse('app:profile-list') + '?me=true'
+    id = auth_client.get(url).data['id']
+
+    response = auth_client.post(reverse('activities:swipe-list'), data={'swiped':id, 'liked':True})
+    assert response.status_code == 400
+    assert response.data['detail'] == 'user can\'t swipe its own profile'
+
+    data = [{'swiped':id, 'liked':True}]
+    response = auth_client.post(reverse('activities:swipe-batch'), data=data, format='json')
+    assert response.status_code == 201
+    assert not response.data[0]['created']
+    assert not Swipe.objects.exists()
+    assert Chat.objects.get_pair(id, id) is None
     
 @pytest.mark.django_db
 def test_get_matches(auth_client):
@@ -193,3 +215,218 @@ def test_swipe_limit(auth_client):
 
     assert response.status_code == 400
     assert response.data['detail'] == 'swipes limit is exceeded for today'
+
+@pytest.mark.django_db
+def test_get_matches_queries(auth_client, django_assert_max_num_queries):
+    '''Test whether matches list takes the same number of queries for any number of likes'''
+    url = reverse('app:profile-list') + '?me=true'
+    response = auth_client.get(url)
+    user_profile = Profile.objects.get(id=response.data['id'])
+
+    for i in range(5):
+        profile: Profile = ProfileFactory(gender='F')
+        SwipeFactory(profile=user_profile, swiped=profile, liked=True)
+        if i % 2 == 0:
+            SwipeFactory(profile=profile, swiped=user_profile, liked=True)
+
+    url = reverse('activities:swipe-list')
+    with django_assert_max_num_queries(3):
+        response = auth_client.get(url)
+
+    assert response.status_code == 200
+    assert len(response.data) == 3
+
+@pytest.mark.django_db
+def test_match_maintained_on_swipe():
+    '''Test whether match is created on reciprocal like and removed when like is withdrawn'''
+    profile: Profile = ProfileFactory(gender='M')
+    other: Profile = ProfileFactory(gender='F')
+
+    swipe: Swipe = SwipeFactory(profile=profile, swiped=other, liked=True)
+    assert not Match.objects.exists()
+
+    other_swipe: Swipe = SwipeFactory(profile=other, swiped=profile, liked=True)
+    assert Match.objects.filter(profile=profile, matched=other).exists()
+    assert Match.objects.filter(profile=other, matched=profile).exists()
+
+    swipe.liked = False
+    swipe.save()
+    assert not Match.objects.exists()
+
+    swipe.liked = True
+    swipe.save()
+    assert Match.objects.count() == 2
+
+    other_swipe.delete()
+    assert not Match.objects.exists()
+
+@pytest.mark.django_db
+def test_get_one_side_liked_profile(auth_client):
+    '''Test whether info is not available about the profile liked by the user only'''
+    url = reverse('app:profile-list') + '?me=true'
+    response = auth_client.get(url)
+    user_profile = Profile.objects.get(id=response.data['id'])
+
+    profile: Profile = ProfileFactory(gender='F')
+    SwipeFactory(profile=user_profile, swiped=profile, liked=True)
+
+    url = reverse('app:profile-detail', kwargs={'pk':profile.id})
+    response = auth_client.get(url)
+    assert response.status_code == 400
+
+@pytest.mark.django_db
+def test_matched_profile_check_cache(auth_client, settings):
+    '''Test whether match check is cached in the shared cache and dropped when the match is removed'''
+    settings.AUTHORIZATION_CACHE = 'default'
+    url = reverse('app:profile-list') + '?me=true'
+    response = auth_client.get(url)
+    user_profile = Profile.objects.get(id=response.data['id'])
+
+    profile: Profile = ProfileFactory(gender='F')
+    SwipeFactory(profile=profile, swiped=user_profile, liked=True)
+    swipe: Swipe = SwipeFactory(profile=user_profile, swiped=profile, liked=True)
+
+    url = reverse('app:profile-detail', kwargs={'pk':profile.id})
+    assert auth_client.get(url).status_code == 200
+    with CaptureQueriesContext(connection) as queries:
+        assert auth_client.get(url).status_code == 200
+    assert not any('activities_match' in query['sql'] for query in queries.captured_queries)
+
+    swipe.delete()
+    assert auth_client.get(url).status_code == 400
+
+@pytest.mark.django_db
+def test_swipe_counter(auth_client):
+    '''Test whether swipes are counted per day and previous days don't limit swipes'''
+    url = reverse('app:profile-list') + '?me=true'
+    response = auth_client.get(url)
+    user_profile = Profile.objects.get(id=response.data['id'])
+    yesterday = timezone.now().date() - timedelta(days=1)
+    SwipeCounter.objects.create(profile=user_profile, day=yesterday, count=settings.VIP_SUBSCRIBTION_SWIPES)
+
+    url = reverse('activities:swipe-list')
+    for i in range(2):
+        profile: Profile = ProfileFactory(gender='F')
+        response = auth_client.post(url, data={'swiped':profile.id, 'liked':False})
+        assert response.status_code == 201
+
+    counter = SwipeCounter.objects.get(profile=user_profile, day=timezone.now().date())
+    assert counter.count == 2
+
+@pytest.mark.django_db
+def test_swipe_queries(auth_client):
+    '''
+        Test whether swipe makes three queries besides two queries of authentication:
+        swiped profile with its like and the repeated swipe check, counter update
+        and swipe insert, like locks both profiles first,
+        matching swipe adds match, chat and its members
+    '''
+    url = reverse('app:profile-list') + '?me=true'
+    response = auth_client.get(url)
+    user_profile = Profile.objects.get(id=response.data['id'])
+    profile: Profile = ProfileFactory(gender='F')
+    SwipeFactory(profile=profile, swiped=user_profile, liked=True)
+
+    def count_queries(data):
+        with CaptureQueriesContext(connection) as queries:
+            response = auth_client.post(reverse('activities:swipe-list'), data=data)
+        assert response.status_code == 201
+        return response, len([
+            query for query in queries.captured_queries
+            if not query['sql'].startswith(('SAVEPOINT', 'RELEASE SAVEPOINT'))
+        ])
+
+    '''First swipe of the day creates today's counter'''
+    count_queries({'swiped':ProfileFactory(gender='F').id, 'liked':True})
+    response, count = count_queries({'swiped':ProfileFactory(gender='F').id, 'liked':False})
+    assert not response.data['match'] and count == 2 + 3
+    response, count = count_queries({'swiped':ProfileFactory(gender='F').id, 'liked':True})
+    assert not response.data['match'] and count == 2 + 1 + 3
+    response, count = count_queries({'swiped':profile.id, 'liked':True})
+    assert response.data['match'] and count == 2 + 1 + 3 + 3
+    assert Chat.objects.filter(user1=user_profile, user2=profile).exists()
+
+    response = auth_client.post(reverse('activities:swipe-list'), data={'swiped':profile.id, 'liked':False})
+    assert response.status_code == 400
+    assert Swipe.objects.filter(profile=user_profile, swiped=profile).get().liked
+
+@pytest.mark.django_db
+def test_batch_swipe(auth_client):
+    '''Test whether batch of swipes is created with result for every swipe'''
+    url = reverse('app:profile-list') + '?me=true'
+    response = auth_client.get(url)
+    user_profile = Profile.objects.get(id=response.data['id'])
+
+    liked_back: Profile = ProfileFactory(gender='F')
+    SwipeFactory(profile=liked_back, swiped=user_profile, liked=True)
+    profile: Profile = ProfileFactory(gender='F')
+    swiped: Profile = ProfileFactory(gender='F')
+    SwipeFactory(profile=user_profile, swiped=swiped, liked=False)
+
+    url = reverse('activities:swipe-batch')
+    data = [
+        {'swiped':liked_back.id, 'liked':True},
+        {'swiped':profile.id, 'liked':False},
+        {'swiped':swiped.id, 'liked':True},
+        {'swiped':profile.id, 'liked':True},
+        {'swiped':0, 'liked':True},
+    ]
+    response = auth_client.post(url, data=data, format='json')
+
+    assert response.status_code == 201
+    assert [result['created'] for result in response.data] == [True, True, False, False, False]
+    assert response.data[0]['match'] == True
+    assert Chat.objects.get(id=response.data[0]['chat']).user2 == liked_back
+    assert not response.data[1]['match']
+    assert Swipe.objects.filter(profile=user_profile).count() == 3
+    assert SwipeCounter.objects.get(profile=user_profile).count == 3
+
+@pytest.mark.django_db
+def test_batch_swipe_limit(auth_client):
+    '''Test whether swipes over the subscription limit are rejected'''
+    url = reverse('app:profile-list') + '?me=true'
+    response = auth_client.get(url)
+    user_profile = Profile.objects.get(id=response.data['id'])
+    limit = settings.VIP_SUBSCRIBTION_SWIPES if user_profile.vip else settings.BASIC_SUBSCRIPTION_SWIPES
+    SwipeCounter.objects.increment(user_profile.id, limit - 1)
+
+    profiles = [ProfileFactory(gender='F') for i in range(2)]
+    url = reverse('activities:swipe-batch')
+    data = [{'swiped':profile.id, 'liked':True} for profile in profiles]
+    response = auth_client.post(url, data=data, format='json')
+
+    assert [result['created'] for result in response.data] == [True, False]
+    assert response.data[1]['detail'] == 'swipes limit is exceeded for today'
+
+@pytest.mark.django_db
+def test_batch_swipe_size(auth_client, settings):
+    '''Test whether oversized batch is rejected before its swipes are validated'''
+    settings.SWIPE_BATCH_SIZE = 2
+    url = reverse('activities:swipe-batch')
+    data = [{'swiped':'invalid'}] * 3
+    response = auth_client.post(url, data=data, format='json')
+
+    assert response.status_code == 400
+    assert response.data['detail'] == 'no more than 2 swipes can be sent at once'
+
+@pytest.mark.django_db
+def test_payloads_hide_coordinates(auth_client):
+    '''Swipe, match list and chat payloads never show profile coordinates'''
+    url = reverse('app:profile-list') + '?me=true'
+    user_profile = Profile.objects.get(id=auth_client.get(url).data['id'])
+    profile: Profile = ProfileFactory(gender='F')
+    LocationFactory(profile=profile)
+    SwipeFactory(profile=profile, swiped=user_profile, liked=True)
+
+    hidden = {'latitude', 'longitude', 'geohash'}
+    url = reverse('activities:swipe-list')
+    response = auth_client.post(url, data={'swiped':profile.id, 'liked':True})
+    assert response.data['match']
+    swipe = response.data['swipe']
+    assert not hidden & (swipe['profile'].keys() | swipe['swiped'].keys())
+
+    match = auth_client.get(url).data[0]
+    assert not hidden & (match['profile'].keys() | match['swiped'].keys())
+
+    chat = auth_client.get(reverse('chat:chat-list')).data[0]
+    assert not hidden & (chat['user1'].keys() | chat['user2'].keys())
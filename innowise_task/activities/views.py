@@ -1,18 +1,22 @@
 from django.shortcuts import render
+from django.db import transaction, IntegrityError
 from rest_framework import generics, viewsets, mixins
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.decorators import action
+from django.conf import settings
 
 from activities.models import Swipe
-from activities.serializers import SwipeSerializer
+from activities.serializers import SwipeSerializer, SwipeBatchSerializer
 from activities.services import (
     get_matches, 
-    is_swipe_available, 
-    is_already_swiped,
-    is_match
+    take_swipe,
+    lock_profiles,
+    get_swiped_profile,
+    create_swipes
 )
-from app.models import Profile
+from app.services import discard_feed_profile
 from chat.models import Chat
 
 class SwipeViewSet(viewsets.GenericViewSet, 
@@ -36,37 +40,68 @@ class SwipeViewSet(viewsets.GenericViewSet,
             Create swipe object when user swipes another user
             If user are matched create a chat object to let users 
             chat with each other
+            Swipe, its match and chat are saved in one transaction,
+            swipes counter stays locked until the swipe is saved
+            Like locks both profiles first, so reciprocal likes made at once
+            are checked one after another and the match is never missed
+            Swiped profile is loaded with its like and the repeated swipe check,
+            swipe is counted and the quota is checked by one update
         '''
-        profile = Profile.objects.get(user=request.user)
-        if is_swipe_available(profile):
-            try:
-                swiped = Profile.objects.get(id=request.data['swiped'])
-                if is_already_swiped(profile, swiped):
+        profile = request.profile
+        try:
+            swiped_id = int(request.data['swiped'])
+        except (KeyError, TypeError, ValueError):
+            message = {'detail':'pleace, specify the \"swiped\" field'}
+            return Response(message, status=status.HTTP_400_BAD_REQUEST)
+        if swiped_id == profile.id:
+            message = {'detail':'user can\'t swipe its own profile'}
+            return Response(message, status=status.HTTP_400_BAD_REQUEST)
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            with transaction.atomic():
+                if serializer.validated_data['liked']:
+                    lock_profiles([profile.id, swiped_id])
+                swiped = get_swiped_profile(profile, swiped_id)
+                if swiped is None:
+                    message = {'detail':'pleace, specify the \"swiped\" field'}
+                    return Response(message, status=status.HTTP_400_BAD_REQUEST)
+                if swiped.already_swiped:
                     message = {'detail':'user have already swiped this profile'}
                     return Response(message, status=status.HTTP_400_BAD_REQUEST)
-            except:
-                message = {'detail':'pleace, specify the \"swiped\" field'}
-                return Response(message, status=status.HTTP_400_BAD_REQUEST)
-            serializer = self.get_serializer(data=request.data)
-            if serializer.is_valid():
-                serializer.save(profile=profile, swiped=swiped)
-                try:
-                    if is_match(profile, swiped, request.data['liked']):
-                        chat = Chat.objects.create(
-                            user1=profile,
-                            user2=swiped
-                        )
-                        chat.save()
-                    message = {
-                        'match': is_match(profile, swiped, request.data['liked']),
-                        'swipe': serializer.data
-                    }
-                except:
-                    message = {'detail':'pleace, specify the \"liked\" field'}
+                if not take_swipe(profile):
+                    message = {'detail':'swipes limit is exceeded for today'}
                     return Response(message, status=status.HTTP_400_BAD_REQUEST)
-                return Response(message, status=status.HTTP_201_CREATED)
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-        message = {'detail':'swipes limit is exceeded for today'}
-        return Response(message, status=status.HTTP_400_BAD_REQUEST)
+                swipe = Swipe(profile=profile, swiped=swiped, liked=serializer.validated_data['liked'])
+                swipe.save(counted=True, liked_back=swiped.liked_back)
+                if swipe.is_match:
+                    Chat.objects.create_pair(profile.id, swiped.id)
+        except IntegrityError:
+            message = {'detail':'user have already swiped this profile'}
+            return Response(message, status=status.HTTP_400_BAD_REQUEST)
+        discard_feed_profile(profile.id, swiped.id)
+        message = {
+            'match': swipe.is_match,
+            'swipe': self.get_serializer(swipe).data
+        }
+        return Response(message, status=status.HTTP_201_CREATED)
 
-    
\ No newline at end of file
+    @action(detail=False, methods=['post'])
+    @transaction.atomic
+    def batch(self, request):
+        '''
+            Create swipes user made offline at once
+            Result is returned for every swipe, chats are created for matches
+            Oversized batch is rejected before its swipes are validated
+        '''
+        if isinstance(request.data, list) and len(request.data) > settings.SWIPE_BATCH_SIZE:
+            message = {'detail':'no more than {} swipes can be sent at once'.format(settings.SWIPE_BATCH_SIZE)}
+            return Response(message, status=status.HTTP_400_BAD_REQUEST)
+        serializer = SwipeBatchSerializer(data=request.data, many=True)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        profile = request.profile
+        results = create_swipes(profile, serializer.validated_data)
+        discard_feed_profile(profile.id, *[result['swiped'] for result in results if result['created']])
+        return Response(results, status=status.HTTP_201_CREATED)
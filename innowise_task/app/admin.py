@@ -1,7 +1,8 @@
 from django.contrib import admin
-from app.models import Profile, Images, Location
+from app.models import Profile, Images, Location, GeocodedLocation
 
 admin.site.register(Profile)
 admin.site.register(Images)
 admin.site.register(Location)
+admin.site.register(GeocodedLocation)
 # Register your models here.
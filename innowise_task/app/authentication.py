@@ -0,0 +1,46 @@
+from django.utils.functional import SimpleLazyObject
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+
+from app.models import Profile
+from app.services import get_profile_id
+
+PROFILE_ID_CLAIM = 'profile_id'
+
+def get_profile(user):
+    '''Get profile of the user, raise Profile.DoesNotExist if user has no profile'''
+    profile_id = get_profile_id(user)
+    if profile_id is None:
+        raise Profile.DoesNotExist('user has no profile')
+    return Profile.objects.get(id=profile_id)
+
+class ProfileJWTAuthentication(JWTAuthentication):
+    '''
+        Authenticate with the access token and attach profile of the user
+        to the request as "profile", it is loaded when it's used for the first time
+        Profile id is taken from "profile_id" claim if the token has it
+    '''
+
+    def authenticate(self, request):
+        authenticated = super().authenticate(request)
+        if authenticated is not None:
+            user = authenticated[0]
+            request.profile = SimpleLazyObject(lambda: get_profile(user))
+        return authenticated
+
+    def get_user(self, validated_token):
+        user = super().get_user(validated_token)
+        if PROFILE_ID_CLAIM in validated_token:
+            user._profile_id = validated_token[PROFILE_ID_CLAIM]
+        return user
+
+class ProfileTokenObtainPairSerializer(TokenObtainPairSerializer):
+    '''Token pair with profile id of the user in "profile_id" claim'''
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        profile_id = get_profile_id(user)
+        if profile_id is not None:
+            token[PROFILE_ID_CLAIM] = profile_id
+        return token
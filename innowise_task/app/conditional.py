@@ -0,0 +1,68 @@
+import hashlib
+import json
+import mimetypes
+import os
+
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import FileResponse, HttpResponse, Http404
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+def get_etag(data) -> str:
+    '''Get ETag of the response data'''
+    content = json.dumps(data, sort_keys=True, cls=DjangoJSONEncoder).encode()
+    return '"{}"'.format(hashlib.md5(content).hexdigest())
+
+def conditional_response(request, data) -> Response:
+    '''
+        Get response of the data with its ETag or 304 Not Modified
+        if the client sends the same ETag in "If-None-Match" header
+    '''
+    etag = get_etag(data)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = Response(data)
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+def get_media_path(path) -> str:
+    '''Get full path of the media file or raise Http404 if there is no such file'''
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404('file not found')
+    if not os.path.isfile(full_path):
+        raise Http404('file not found')
+    return full_path
+
+def media_response(request, path) -> HttpResponse:
+    '''
+        Get response of the media file with its validators or 304 Not Modified
+        File is sent by the web server if MEDIA_SENDFILE is set, otherwise it is streamed
+    '''
+    full_path = get_media_path(path)
+    stat = os.stat(full_path)
+    etag = '"{:x}-{:x}"'.format(stat.st_mtime_ns, stat.st_size)
+    last_modified = int(stat.st_mtime)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        content_type, encoding = mimetypes.guess_type(full_path)
+        if settings.MEDIA_SENDFILE == 'x-accel-redirect':
+            response = HttpResponse(content_type=content_type or 'application/octet-stream')
+            response['X-Accel-Redirect'] = quote(settings.MEDIA_SENDFILE_URL + path)
+        elif settings.MEDIA_SENDFILE == 'x-sendfile':
+            response = HttpResponse(content_type=content_type or 'application/octet-stream')
+            response['X-Sendfile'] = full_path
+        else:
+            response = FileResponse(open(full_path, 'rb'))
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, public=True, max_age=settings.MEDIA_CACHE_MAX_AGE, immutable=True)
+    return response
@@ -0,0 +1,111 @@
+
+import math
+
+import numpy as np
+from geopy.distance import geodesic
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 111.32
+
+'''Max relative error of the spherical distance against the ellipsoidal one'''
+SPHERICAL_DISTANCE_ERROR = 0.005
+
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 12
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION) -> str:
+    '''Encode coordinates to the geohash string of the given precision'''
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    geohash, bits, char, even = [], 0, 0, True
+    while len(geohash) < precision:
+        coord_range, value = (lon_range, longitude) if even else (lat_range, latitude)
+        mid = (coord_range[0] + coord_range[1]) / 2
+        char <<= 1
+        if value >= mid:
+            char |= 1
+            coord_range[0] = mid
+        else:
+            coord_range[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            geohash.append(GEOHASH_BASE32[char])
+            bits, char = 0, 0
+    return ''.join(geohash)
+
+def geohash_cell_size(precision) -> tuple:
+    '''Get height and width of the geohash cell in degrees'''
+    lat_bits = precision * 5 // 2
+    lon_bits = precision * 5 - lat_bits
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+def get_bounding_box(latitude, longitude, radius) -> tuple:
+    '''
+        Get (min_lat, max_lat, min_lon, max_lon) box around the point
+        containing the whole circle of the radius in kilometers
+        Longitude bounds are None if the box can't be described by one range,
+        near the poles or across the antimeridian
+    '''
+    lat_delta = radius / KM_PER_DEGREE
+    min_lat, max_lat = max(latitude - lat_delta, -90.0), min(latitude + lat_delta, 90.0)
+    cos_lat = min(math.cos(math.radians(min_lat)), math.cos(math.radians(max_lat)))
+    if cos_lat <= 0:
+        return min_lat, max_lat, None, None
+    lon_delta = radius / (KM_PER_DEGREE * cos_lat)
+    min_lon, max_lon = longitude - lon_delta, longitude + lon_delta
+    if min_lon < -180.0 or max_lon > 180.0:
+        return min_lat, max_lat, None, None
+    return min_lat, max_lat, min_lon, max_lon
+
+def get_geohash_cover(min_lat, max_lat, min_lon, max_lon) -> list:
+    '''
+        Get geohash prefixes of the cells covering the bounding box
+        Precision is chosen so that the box is covered by at most 2x2 cells
+    '''
+    precision = GEOHASH_PRECISION
+    while precision > 1:
+        height, width = geohash_cell_size(precision)
+        if height >= max_lat - min_lat and width >= max_lon - min_lon:
+            break
+        precision -= 1
+    height, width = geohash_cell_size(precision)
+    cells = set()
+    lat = min_lat
+    while True:
+        lon = min_lon
+        while True:
+            cells.add(encode_geohash(lat, lon, precision))
+            if lon >= max_lon:
+                break
+            lon = min(lon + width, max_lon)
+        if lat >= max_lat:
+            break
+        lat = min(lat + height, max_lat)
+    return sorted(cells)
+
+def haversine_distances(latitude, longitude, latitudes, longitudes) -> np.ndarray:
+    '''
+        Get great-circle distances in kilometers from the point
+        to all the points given by arrays of latitudes and longitudes
+    '''
+    lat1, lon1 = np.radians(latitude), np.radians(longitude)
+    lat2 = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lon2 = np.radians(np.asarray(longitudes, dtype=np.float64))
+    a = np.sin((lat2 - lat1) / 2) ** 2 \
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def within_radius(latitude, longitude, latitudes, longitudes, radius, exact=False) -> np.ndarray:
+    '''
+        Get mask of the points located in the radius around the point
+        Spherical approximation is used for all the points, if exact is set
+        the points close to the border are checked with geodesic distance
+    '''
+    distances = haversine_distances(latitude, longitude, latitudes, longitudes)
+    if not exact:
+        return distances < radius
+    mask = distances < radius * (1 - SPHERICAL_DISTANCE_ERROR)
+    border = np.flatnonzero(~mask & (distances < radius * (1 + SPHERICAL_DISTANCE_ERROR)))
+    for i in border:
+        mask[i] = geodesic((latitude, longitude), (latitudes[i], longitudes[i])) < radius
+    return mask
@@ -0,0 +1,265 @@
+
+import logging
+import math
+import queue
+import threading
+import time
+
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections
+from django.utils.module_loading import import_string
+
+from geopy.exc import GeopyError
+from geopy.geocoders import Nominatim
+
+logger = logging.getLogger(__name__)
+
+class GeocodingError(Exception):
+    '''Geocoding service is unavailable or failed to answer'''
+
+class LocationNotFound(Exception):
+    '''Location can't be resolved to coordinates'''
+
+def normalize_location(location) -> str:
+    '''Get the cache key of the location name'''
+    return ' '.join(str(location).lower().split())
+
+class NominatimGeocoder:
+    '''Resolve locations with Nominatim service of OpenStreetMap'''
+
+    def __init__(self):
+        self.geolocator = Nominatim(user_agent="InnowiseTaskApp", timeout=settings.GEOCODING_TIMEOUT)
+
+    def geocode(self, location):
+        '''Get coordinates of the location or None if it is not found'''
+        try:
+            found = self.geolocator.geocode(location)
+        except GeopyError as e:
+            raise GeocodingError(str(e)) from e
+        return (found.latitude, found.longitude) if found else None
+
+class StubGeocoder:
+    '''Resolve locations from GEOCODING_STUB_LOCATIONS setting without network'''
+
+    def geocode(self, location):
+        '''Get coordinates of the location or None if it is not found'''
+        return settings.GEOCODING_STUB_LOCATIONS.get(normalize_location(location))
+
+@lru_cache(maxsize=None)
+def load_geocoder(path):
+    return import_string(path)()
+
+def get_geocoder():
+    '''Get geocoder instance configured with GEOCODER setting'''
+    return load_geocoder(settings.GEOCODER)
+
+class RateLimiter:
+    '''
+        Space calls out to make no more than GEOCODING_RATE_LIMIT calls per second
+        Every call reserves a time slot in GEOCODING_RATE_LIMIT_CACHE along with
+        its time, which is spaced from the call of the previous slot, so the limit
+        is shared by all the processes using the cache
+    '''
+
+    def get_key(self, slot) -> str:
+        return 'geocoding_slot:{}'.format(slot)
+
+    def wait(self):
+        rate = settings.GEOCODING_RATE_LIMIT
+        if not rate:
+            return
+        rate_cache = caches[settings.GEOCODING_RATE_LIMIT_CACHE]
+        now = time.time()
+        slot = int(now * rate)
+        while True:
+            previous = rate_cache.get(self.get_key(slot - 1))
+            call_time = now if previous is None else max(now, previous + 1 / rate)
+            timeout = math.ceil((slot + 2) / rate - now) + 1
+            if rate_cache.add(self.get_key(slot), call_time, timeout):
+                break
+            slot += 1
+        if call_time > now:
+            time.sleep(call_time - now)
+
+class GeocodingCache:
+    '''
+        Cache of geocoded locations keyed on the normalized location name
+        In-process LRU is kept in front of the GeocodedLocation table shared by
+        all the processes, unresolvable names are cached for a shorter time
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.stats = {'hits': 0, 'db_hits': 0, 'misses': 0}
+        self.rate_limiter = RateLimiter()
+
+    def clear(self):
+        '''Drop in-process entries and reset counters'''
+        with self.lock:
+            self.entries.clear()
+            self.stats = dict.fromkeys(self.stats, 0)
+
+    def count(self, counter):
+        with self.lock:
+            self.stats[counter] += 1
+
+    def get_expiration(self, coordinates, date):
+        ttl = settings.GEOCODING_CACHE_TTL if coordinates else settings.GEOCODING_NEGATIVE_CACHE_TTL
+        return date + timedelta(seconds=ttl)
+
+    def get_local(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= datetime.now(timezone.utc):
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def set_local(self, key, coordinates, date):
+        with self.lock:
+            self.entries[key] = (coordinates, self.get_expiration(coordinates, date))
+            self.entries.move_to_end(key)
+            while len(self.entries) > settings.GEOCODING_CACHE_SIZE:
+                self.entries.popitem(last=False)
+
+    def lookup(self, location):
+        '''
+            Get coordinates of the location, None if the location is unresolvable
+            Geocoder is called only if there is no fresh cached answer
+        '''
+        GeocodedLocation = apps.get_model('app', 'GeocodedLocation')
+        key = normalize_location(location)
+        if len(key) == 0 or len(key) > GeocodedLocation._meta.get_field('query').max_length:
+            return None
+
+        entry = self.get_local(key)
+        if entry is not None:
+            self.count('hits')
+            return entry[0]
+
+        row = GeocodedLocation.objects.filter(query=key).first()
+        if row is not None:
+            coordinates = row.coordinates
+            if self.get_expiration(coordinates, row.date) > datetime.now(timezone.utc):
+                self.count('db_hits')
+                self.set_local(key, coordinates, row.date)
+                return coordinates
+
+        self.count('misses')
+        self.rate_limiter.wait()
+        coordinates = get_geocoder().geocode(location)
+        latitude, longitude = coordinates if coordinates else (None, None)
+        row, created = GeocodedLocation.objects.update_or_create(
+            query=key,
+            defaults={'latitude': latitude, 'longitude': longitude}
+        )
+        self.set_local(key, coordinates, row.date)
+        return coordinates
+
+    def get_coordinates(self, location) -> tuple:
+        '''Get coordinates of the location or raise LocationNotFound'''
+        coordinates = self.lookup(location)
+        if coordinates is None:
+            raise LocationNotFound(location)
+        return coordinates
+
+geocoding_cache = GeocodingCache()
+
+class GeocodingPipeline:
+    '''
+        Geocode locations in the background worker threads
+        Workers take queued locations in batches, identical location names
+        submitted before they are resolved are geocoded once, results are
+        passed to on_resolved(location_ids, location, coordinates)
+        Unavailable geocoder is retried GEOCODING_RETRIES times with doubling
+        delays, locations which are not found or still failed are passed
+        to on_failed(location_ids, location)
+    '''
+
+    def __init__(self, on_resolved, on_failed):
+        self.on_resolved = on_resolved
+        self.on_failed = on_failed
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.workers = []
+
+    def submit(self, location_id, location):
+        '''Queue location to be geocoded'''
+        key = normalize_location(location)
+        with self.lock:
+            if key in self.pending:
+                self.pending[key][1].add(location_id)
+                return
+            self.pending[key] = (location, {location_id})
+        self.queue.put(key)
+        self.start()
+
+    def start(self):
+        with self.lock:
+            while len(self.workers) < settings.GEOCODING_WORKERS:
+                worker = threading.Thread(target=self.work, daemon=True)
+                self.workers.append(worker)
+                worker.start()
+
+    def get_batch(self, block=True) -> list:
+        try:
+            batch = [self.queue.get(block=block)]
+        except queue.Empty:
+            return []
+        while len(batch) < settings.GEOCODING_BATCH_SIZE:
+            try:
+                batch.append(self.queue.get(timeout=settings.GEOCODING_BATCH_WAIT))
+            except queue.Empty:
+                break
+        return batch
+
+    def work(self):
+        while True:
+            self.process(self.get_batch())
+
+    def drain(self):
+        '''Process all the queued locations in the current thread'''
+        batch = self.get_batch(block=False)
+        while batch:
+            self.process(batch)
+            batch = self.get_batch(block=False)
+
+    def geocode(self, location):
+        '''Get coordinates of the location, retry the geocoder while it is unavailable'''
+        for attempt in range(settings.GEOCODING_RETRIES):
+            try:
+                return geocoding_cache.lookup(location)
+            except GeocodingError:
+                logger.warning('Geocoder is unavailable, retrying location %s', location)
+                time.sleep(settings.GEOCODING_RETRY_DELAY * 2 ** attempt)
+        return geocoding_cache.lookup(location)
+
+    def process(self, batch):
+        for key in batch:
+            location = self.pending[key][0]
+            try:
+                coordinates = self.geocode(location)
+            except Exception:
+                logger.exception('Failed to geocode location %s', location)
+                coordinates = None
+            with self.lock:
+                location_ids = self.pending.pop(key)[1]
+            try:
+                if coordinates is None:
+                    self.on_failed(location_ids, location)
+                else:
+                    self.on_resolved(location_ids, location, coordinates)
+            except Exception:
+                logger.exception('Failed to save coordinates of location %s', location)
+        close_old_connections()
@@ -0,0 +1,158 @@
+
+import io
+import logging
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction, close_old_connections
+
+from PIL import Image, ImageOps, features
+
+from app.storage import get_file_digest, delete_unused_files
+
+logger = logging.getLogger(__name__)
+
+'''Extensions of the image formats whose Pillow names differ from them'''
+FORMAT_EXTENSIONS = {'JPEG': 'jpg', 'TIFF': 'tif'}
+
+DERIVATIVE_SUFFIXES = {'thumbnail': 'thumb', 'feed': 'feed'}
+
+image_executor = ThreadPoolExecutor(max_workers=max(settings.IMAGE_PROCESSING_WORKERS, 1))
+
+def get_derivative_format() -> tuple:
+    '''Get Pillow format and file extension of the derivatives, JPEG if WebP is unsupported'''
+    if settings.IMAGE_DERIVATIVE_FORMAT == 'WEBP' and features.check('webp'):
+        return 'WEBP', 'webp'
+    return 'JPEG', 'jpg'
+
+def get_image_extension(file) -> str:
+    '''Get file extension of the image format detected by its contents'''
+    file.seek(0)
+    try:
+        with Image.open(file) as image:
+            format = image.format
+    finally:
+        file.seek(0)
+    return FORMAT_EXTENSIONS.get(format, format.lower())
+
+def strip_metadata(file) -> ContentFile:
+    '''
+        Encode the uploaded image turned according to its EXIF orientation
+        without EXIF, so location and camera details are not published
+        Image is kept in its format, PNG is used if Pillow can't write it
+    '''
+    file.seek(0)
+    with Image.open(file) as original:
+        format = original.format
+        animated = getattr(original, 'is_animated', False)
+        image = original if animated else ImageOps.exif_transpose(original)
+        options = {'save_all': True} if animated else {}
+        if 'icc_profile' in original.info:
+            options['icc_profile'] = original.info['icc_profile']
+        if format == 'JPEG':
+            options['quality'] = settings.IMAGE_ORIGINAL_QUALITY
+        output = io.BytesIO()
+        try:
+            image.save(output, format, **options)
+        except (KeyError, OSError, ValueError):
+            output = io.BytesIO()
+            image.save(output, 'PNG')
+    return ContentFile(output.getvalue(), name=os.path.basename(file.name))
+
+def open_image(file) -> Image.Image:
+    '''Open image turned according to its EXIF orientation'''
+    image = Image.open(file)
+    image.load()
+    return ImageOps.exif_transpose(image)
+
+def make_derivative(image, size, crop=False) -> ContentFile:
+    '''
+        Encode image scaled down to the size in the derivative format
+        With crop image is cut to fill the size exactly, otherwise it fits in it
+        Metadata of the original is not copied so EXIF is stripped
+    '''
+    format, ext = get_derivative_format()
+    if crop:
+        image = ImageOps.fit(image, size, Image.LANCZOS)
+    else:
+        image = image.copy()
+        image.thumbnail(size, Image.LANCZOS)
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    image = image.convert('RGBA' if has_alpha and format == 'WEBP' else 'RGB')
+    output = io.BytesIO()
+    image.save(output, format, quality=settings.IMAGE_DERIVATIVE_QUALITY)
+    return ContentFile(output.getvalue())
+
+def process_image(instance):
+    '''
+        Generate thumbnail and feed derivatives of the uploaded image
+        Derivatives of the image with the same contents are reused, their names
+        carry the digest of their contents to change URLs with the settings
+    '''
+    Images = type(instance)
+    ImageContent = apps.get_model('app', 'ImageContent')
+    previous = (instance.thumbnail.name, instance.feed.name)
+    if instance.digest:
+        with transaction.atomic():
+            ImageContent.objects.lock(instance.digest)
+            same = Images.objects\
+                .filter(digest=instance.digest)\
+                .exclude(id=instance.id)\
+                .exclude(feed='')\
+                .values_list('thumbnail', 'feed')\
+                .first()
+            if same:
+                instance.thumbnail, instance.feed = same
+                Images.objects.filter(id=instance.id).update(thumbnail=same[0], feed=same[1])
+        if same:
+            delete_unused_files(previous, instance.digest)
+            return
+
+    with instance.image.open('rb') as file:
+        image = open_image(file)
+        derivatives = {
+            field: make_derivative(image, size, crop)
+            for field, size, crop in (
+                ('thumbnail', settings.IMAGE_THUMBNAIL_SIZE, True),
+                ('feed', settings.IMAGE_FEED_SIZE, False)
+            )
+        }
+    stem = os.path.splitext(os.path.basename(instance.image.name))[0]
+    ext = get_derivative_format()[1]
+    with transaction.atomic():
+        if instance.digest:
+            ImageContent.objects.lock(instance.digest)
+        for field, derivative in derivatives.items():
+            getattr(instance, field).save(
+                '{}_{}_{}.{}'.format(stem, get_file_digest(derivative)[:12], DERIVATIVE_SUFFIXES[field], ext),
+                derivative,
+                save=False
+            )
+        Images.objects\
+            .filter(id=instance.id)\
+            .update(thumbnail=instance.thumbnail.name, feed=instance.feed.name)
+    delete_unused_files(previous, instance.digest)
+
+def process_image_in_worker(image_id):
+    try:
+        instance = apps.get_model('app', 'Images').objects.filter(id=image_id).first()
+        if instance is not None:
+            process_image(instance)
+    except Exception:
+        logger.exception('Failed to process image %s', image_id)
+    finally:
+        close_old_connections()
+
+def schedule_image_processing(instance):
+    '''
+        Process image in the worker pool once the upload is committed,
+        in the current thread if IMAGE_PROCESSING_WORKERS is 0
+    '''
+    if settings.IMAGE_PROCESSING_WORKERS == 0:
+        process_image(instance)
+        return
+    transaction.on_commit(lambda: image_executor.submit(process_image_in_worker, instance.id))
@@ -0,0 +1,28 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from app.registration import import_users_file
+
+class Command(BaseCommand):
+    help = 'Register users from JSON lines or CSV file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File with users, "-" to read stdin')
+        parser.add_argument('--format', choices=('jsonl', 'csv'))
+        parser.add_argument('--chunk-size', type=int)
+        parser.add_argument('--workers', type=int)
+
+    def handle(self, *args, **options):
+        kwargs = {'chunk_size': options['chunk_size'], 'workers': options['workers']}
+        if options['path'] == '-':
+            result = import_users_file(sys.stdin.buffer, '', options['format'], **kwargs)
+        else:
+            with open(options['path'], 'rb') as file:
+                result = import_users_file(file, options['path'], options['format'], **kwargs)
+
+        for error in result['errors']:
+            self.stderr.write('line {}: {}'.format(error['line'], error['detail']))
+        self.stdout.write(self.style.SUCCESS(
+            'Created {} users, skipped {} existing'.format(result['created'], result['skipped'])
+        ))
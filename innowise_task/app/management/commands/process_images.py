@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from app.images import process_image
+from app.models import Images
+
+class Command(BaseCommand):
+    help = 'Generate thumbnail and feed copies of images which have none'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Regenerate copies of all the images')
+
+    def handle(self, *args, **options):
+        images = Images.objects.all() if options['all'] else Images.objects.filter(feed='')
+        processed, failed = 0, 0
+        for image in images.iterator():
+            try:
+                process_image(image)
+                processed += 1
+            except Exception as e:
+                failed += 1
+                self.stderr.write('image {}: {}'.format(image.id, e))
+        self.stdout.write(self.style.SUCCESS(
+            'Processed {} images, failed {}'.format(processed, failed)
+        ))
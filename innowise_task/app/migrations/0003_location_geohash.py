@@ -0,0 +1,29 @@
+# Generated by Django 3.1.6 on 2026-10-18 10:18
+
+from django.db import migrations, models
+
+from app.geo import encode_geohash
+
+
+def fill_geohash(apps, schema_editor):
+    Location = apps.get_model('app', 'Location')
+    locations = Location.objects.filter(latitude__isnull=False, longitude__isnull=False)
+    for location in locations.iterator():
+        location.geohash = encode_geohash(location.latitude, location.longitude)
+        location.save(update_fields=['geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0002_auto_20210208_0722'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='location',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=12),
+        ),
+        migrations.RunPython(fill_geohash, migrations.RunPython.noop),
+    ]
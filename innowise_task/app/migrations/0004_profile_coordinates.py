@@ -0,0 +1,49 @@
+# Generated by Django 3.1.6 on 2026-10-18 10:21
+
+from django.db import migrations, models
+
+from app.geo import encode_geohash
+
+
+def copy_coordinates(apps, schema_editor):
+    Location = apps.get_model('app', 'Location')
+    Profile = apps.get_model('app', 'Profile')
+    locations = Location.objects\
+        .filter(latitude__isnull=False, longitude__isnull=False)\
+        .order_by('profile_id', 'date')
+    for location in locations.iterator():
+        Profile.objects.filter(id=location.profile_id).update(
+            latitude=location.latitude,
+            longitude=location.longitude,
+            geohash=encode_geohash(location.latitude, location.longitude)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0003_location_geohash'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='location',
+            name='geohash',
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=12),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='latitude',
+            field=models.FloatField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='longitude',
+            field=models.FloatField(default=None, null=True),
+        ),
+        migrations.RunPython(copy_coordinates, migrations.RunPython.noop),
+    ]
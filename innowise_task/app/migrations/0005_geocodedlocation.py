@@ -0,0 +1,23 @@
+# Generated by Django 3.1.6 on 2026-10-18 10:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_profile_coordinates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeocodedLocation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('query', models.CharField(max_length=100, unique=True)),
+                ('latitude', models.FloatField(default=None, null=True)),
+                ('longitude', models.FloatField(default=None, null=True)),
+                ('date', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
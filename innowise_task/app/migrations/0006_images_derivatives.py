@@ -0,0 +1,24 @@
+# Generated by Django 3.1.6 on 2026-10-18 10:41
+
+import app.services
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_geocodedlocation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='images',
+            name='feed',
+            field=models.ImageField(blank=True, default='', upload_to=app.services.image_derivative_path),
+        ),
+        migrations.AddField(
+            model_name='images',
+            name='thumbnail',
+            field=models.ImageField(blank=True, default='', upload_to=app.services.image_derivative_path),
+        ),
+    ]
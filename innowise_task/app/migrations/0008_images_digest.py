@@ -0,0 +1,35 @@
+# Generated by Django 3.1.6 on 2026-10-18 10:45
+
+import app.services
+import app.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_imageupload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='images',
+            name='digest',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='images',
+            name='feed',
+            field=models.ImageField(blank=True, default='', storage=app.storage.ContentAddressedStorage(), upload_to=app.services.image_derivative_path),
+        ),
+        migrations.AlterField(
+            model_name='images',
+            name='image',
+            field=models.ImageField(storage=app.storage.ContentAddressedStorage(), upload_to=app.services.image_file_path),
+        ),
+        migrations.AlterField(
+            model_name='images',
+            name='thumbnail',
+            field=models.ImageField(blank=True, default='', storage=app.storage.ContentAddressedStorage(), upload_to=app.services.image_derivative_path),
+        ),
+    ]
@@ -1,8 +1,13 @@
 
-from django.db import models
+import uuid
+
+from django.db import models, transaction
 from django.conf import settings
 
-from app.services import image_file_path
+from app.services import image_file_path, image_derivative_path
+from app.geo import encode_geohash
+from app.storage import content_addressed_storage, get_file_digest
+from app.images import get_image_extension, strip_metadata
 
 class Profile(models.Model):
     GENDER_CHOICES = [
@@ -16,6 +21,11 @@ class Profile(models.Model):
     vip = models.BooleanField(default=False)
     gender = models.CharField(max_length=1, choices=GENDER_CHOICES)
 
+    '''Current coordinates, copied from the profile location when it is saved'''
+    latitude = models.FloatField(default=None, null=True)
+    longitude = models.FloatField(default=None, null=True)
+    geohash = models.CharField(max_length=12, blank=True, default='', db_index=True)
+
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
@@ -24,16 +34,82 @@ class Profile(models.Model):
     def __str__(self):
         return '{} {}'.format(self.user.first_name, self.user.last_name)
 
+    def set_coordinates(self, latitude, longitude):
+        '''Set current coordinates of the profile and their geohash cell'''
+        self.latitude, self.longitude = latitude, longitude
+        if latitude is not None and longitude is not None:
+            self.geohash = encode_geohash(latitude, longitude)
+        else:
+            self.geohash = ''
+
 class Images(models.Model):
-    image = models.ImageField(upload_to=image_file_path)
+    '''
+        Profile image stored by its contents, images with the same contents share
+        the files, which are deleted when the last of the images is deleted
+    '''
+    image = models.ImageField(upload_to=image_file_path, storage=content_addressed_storage)
     date = models.DateTimeField(auto_now_add=True)
 
+    '''SHA-256 of the image file'''
+    digest = models.CharField(max_length=64, blank=True, default='', db_index=True)
+
+    '''Scaled down copies of the image, generated after it is uploaded'''
+    thumbnail = models.ImageField(
+        upload_to=image_derivative_path, storage=content_addressed_storage, blank=True, default=''
+    )
+    feed = models.ImageField(
+        upload_to=image_derivative_path, storage=content_addressed_storage, blank=True, default=''
+    )
+
     profile = models.ForeignKey(
         Profile,
         on_delete=models.CASCADE,
         related_name='images',
     )
 
+    def save(self, *args, **kwargs):
+        '''
+            Save new image without EXIF named by the digest of the file and
+            the extension of its detected format, so the same contents get the same name
+        '''
+        if self.image and not self.image._committed:
+            self.image = strip_metadata(self.image)
+            self.digest = get_file_digest(self.image)
+            self.image.name = '{}.{}'.format(self.digest, get_image_extension(self.image))
+            with transaction.atomic(savepoint=False):
+                ImageContent.objects.lock(self.digest)
+                return super().save(*args, **kwargs)
+        super().save(*args, **kwargs)
+
+class ImageContentManager(models.Manager):
+
+    def lock(self, digest):
+        '''
+            Lock files of the digest until the end of the transaction,
+            so they are not deleted while they are written and used
+        '''
+        self.select_for_update().get_or_create(digest=digest)
+
+class ImageContent(models.Model):
+    '''Digest of the stored image files, the row is locked to write or delete them'''
+    digest = models.CharField(max_length=64, primary_key=True)
+
+    objects = ImageContentManager()
+
+class ImageUpload(models.Model):
+    '''Image uploaded in chunks by several requests, removed when it is complete'''
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    filename = models.CharField(max_length=100)
+    size = models.PositiveIntegerField()
+    offset = models.PositiveIntegerField(default=0)
+    date = models.DateTimeField(auto_now_add=True)
+
+    profile = models.ForeignKey(
+        Profile,
+        on_delete=models.CASCADE,
+        related_name='+',
+    )
+
 class Location(models.Model):
     location = models.CharField(max_length=100)
     date = models.DateTimeField(auto_now=True)
@@ -50,3 +126,32 @@ class Location(models.Model):
     def __str__(self):
         return '{}, {}'.format(self.profile, self.location)
 
+    def save(self, *args, **kwargs):
+        '''Keep current coordinates of the profile in sync with its location'''
+        super().save(*args, **kwargs)
+        if Location.profile.is_cached(self):
+            profile = self.profile
+        else:
+            profile = Profile(id=self.profile_id)
+        profile.set_coordinates(self.latitude, self.longitude)
+        Profile.objects.filter(id=self.profile_id).update(
+            latitude=profile.latitude,
+            longitude=profile.longitude,
+            geohash=profile.geohash
+        )
+
+class GeocodedLocation(models.Model):
+    '''Cached geocoder answer, coordinates are empty if location is not found'''
+    query = models.CharField(max_length=100, unique=True)
+    latitude = models.FloatField(default=None, null=True)
+    longitude = models.FloatField(default=None, null=True)
+    date = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '{}: {}'.format(self.query, self.coordinates)
+
+    @property
+    def coordinates(self):
+        if self.latitude is None or self.longitude is None:
+            return None
+        return self.latitude, self.longitude
@@ -0,0 +1,145 @@
+
+import csv
+import io
+import json
+
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+
+from app.models import Profile, Location
+
+USER_FIELDS = ('username', 'first_name', 'last_name', 'email', 'password')
+MAX_REPORTED_ERRORS = 100
+
+def read_users(stream, format) -> iter:
+    '''
+        Read users from the text stream of JSON lines or CSV with header
+        Yield line number and user data for every row
+    '''
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(stream, start=1):
+        if line.strip():
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield line_number, row if isinstance(row, dict) else None
+
+def get_format(filename, format=None) -> str:
+    '''Get import format from the explicit value or the file extension'''
+    if format:
+        return format
+    return 'csv' if str(filename).lower().endswith('.csv') else 'jsonl'
+
+def validate_user(row) -> str:
+    '''Get error of the user data or None if it is valid'''
+    if row is None:
+        return 'invalid row'
+    for field in USER_FIELDS:
+        if not row.get(field):
+            return 'field "{}" is required'.format(field)
+        if not isinstance(row[field], str):
+            return 'field "{}" must be a string'.format(field)
+        if len(row[field]) > User._meta.get_field(field).max_length:
+            return 'field "{}" is too long'.format(field)
+    try:
+        UnicodeUsernameValidator()(row['username'])
+        validate_email(row['email'])
+    except ValidationError as e:
+        return e.messages[0]
+    return None
+
+def create_users(rows, passwords) -> int:
+    '''
+        Create users with their profiles and empty locations in bulk
+        Users, profiles and locations are inserted by one query each
+    '''
+    with transaction.atomic():
+        User.objects.bulk_create([
+            User(
+                username=row['username'],
+                first_name=row['first_name'],
+                last_name=row['last_name'],
+                email=row['email'],
+                password=password
+            )
+            for row, password in zip(rows, passwords)
+        ])
+        users = list(User.objects\
+            .filter(username__in=[row['username'] for row in rows])\
+            .values_list('id', 'first_name', 'last_name'))
+        Profile.objects.bulk_create([
+            Profile(user_id=id, fname=first_name, lname=last_name)
+            for id, first_name, last_name in users
+        ])
+        profiles = Profile.objects\
+            .filter(user_id__in=[user[0] for user in users])\
+            .values_list('id', flat=True)
+        Location.objects.bulk_create([Location(profile_id=id) for id in profiles])
+    return len(rows)
+
+def import_users(users, chunk_size=None, workers=None) -> dict:
+    '''
+        Register users from the iterable of (line number, user data) in chunks
+        Passwords are hashed in the process pool, each chunk is inserted
+        in its own transaction, existing and repeated usernames are skipped
+        as rows of the previous chunks are already in the database
+    '''
+    chunk_size = chunk_size or settings.BULK_IMPORT_CHUNK_SIZE
+    workers = settings.BULK_IMPORT_WORKERS if workers is None else workers
+    result = {'created': 0, 'skipped': 0, 'errors': []}
+
+    def report(line_number, detail):
+        if len(result['errors']) < MAX_REPORTED_ERRORS:
+            result['errors'].append({'line': line_number, 'detail': detail})
+
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        users = iter(users)
+        chunk = list(islice(users, chunk_size))
+        while chunk:
+            rows, seen = [], set()
+            for line_number, row in chunk:
+                error = validate_user(row)
+                if error:
+                    report(line_number, error)
+                elif row['username'] in seen:
+                    result['skipped'] += 1
+                else:
+                    seen.add(row['username'])
+                    rows.append(row)
+
+            existing = set(User.objects\
+                .filter(username__in=[row['username'] for row in rows])\
+                .values_list('username', flat=True))
+            result['skipped'] += len(existing)
+            rows = [row for row in rows if row['username'] not in existing]
+
+            passwords = [row['password'] for row in rows]
+            if pool:
+                passwords = list(pool.map(make_password, passwords, chunksize=max(len(passwords) // workers, 1)))
+            else:
+                passwords = [make_password(password) for password in passwords]
+            result['created'] += create_users(rows, passwords)
+            chunk = list(islice(users, chunk_size))
+    finally:
+        if pool:
+            pool.shutdown()
+    return result
+
+def import_users_file(file, filename, format=None, **kwargs) -> dict:
+    '''Register users from the binary file of JSON lines or CSV'''
+    stream = io.TextIOWrapper(file, encoding='utf-8', newline='')
+    return import_users(read_users(stream, get_format(filename, format)), **kwargs)
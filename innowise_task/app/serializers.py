@@ -1,6 +1,8 @@
 from rest_framework import serializers
 
-from app.models import Profile, Images, Location
+from django.conf import settings
+
+from app.models import Profile, Images, Location, ImageUpload
 from django.contrib.auth.models import User
 
 class ProfileSerializer(serializers.ModelSerializer):
@@ -23,6 +25,14 @@ class ProfileSerializer(serializers.ModelSerializer):
         return super(ProfileSerializer, self).create(validated_data)
 
 
+class NestedProfileSerializer(serializers.ModelSerializer):
+    '''Profile nested in other objects, coordinates are never shown to other users'''
+
+    class Meta:
+        model = Profile
+        fields = ('id', 'fname', 'lname', 'info', 'vip', 'gender', 'user')
+        read_only_fields = fields
+
 class UserSerializer(serializers.ModelSerializer):
 
     class Meta:
@@ -44,18 +54,80 @@ class UserSerializer(serializers.ModelSerializer):
         instance.save()
         return instance
 
+class ImageVariantField(serializers.ReadOnlyField):
+    '''URL of the image derivative, original image is used until it is generated'''
+
+    def __init__(self, **kwargs):
+        super().__init__(source='*', **kwargs)
+        self.variant = None
+
+    def bind(self, field_name, parent):
+        super().bind(field_name, parent)
+        self.variant = field_name
+
+    def to_representation(self, instance):
+        file = getattr(instance, self.variant) or instance.image
+        if not file:
+            return None
+        request = self.context.get('request')
+        return request.build_absolute_uri(file.url) if request else file.url
+
 class ImagesSerializer(serializers.ModelSerializer):
+    '''Image with "thumbnail" for lists and "feed" for swipe cards'''
+    thumbnail = ImageVariantField()
+    feed = ImageVariantField()
 
     class Meta:
         model = Images
-        fields = ('image', 'profile', 'date')
+        fields = ('id', 'image', 'thumbnail', 'feed', 'profile', 'date')
         read_only_fields = ('profile', 'date')
 
+    def validate_image(self, value):
+        max_width, max_height = settings.IMAGE_UPLOAD_MAX_DIMENSIONS
+        width, height = value.image.size
+        if width > max_width or height > max_height:
+            raise serializers.ValidationError(
+                'image dimensions should be no more than {}x{}'.format(max_width, max_height)
+            )
+        return value
+
+class ImageUploadSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = ImageUpload
+        fields = ('id', 'filename', 'size', 'offset', 'date')
+        read_only_fields = ('id', 'offset', 'date')
+
+
+class ProfileImageSerializer(ImagesSerializer):
+    '''Image URLs embedded in the expanded profile'''
+
+    class Meta(ImagesSerializer.Meta):
+        fields = ('id', 'image', 'thumbnail', 'feed')
+
+class ProfileLocationSerializer(serializers.ModelSerializer):
+    '''Location embedded in the expanded profile'''
+
+    class Meta:
+        model = Location
+        fields = ('id', 'location', 'latitude', 'longitude')
+
+class ExpandedProfileSerializer(ProfileSerializer):
+    '''
+        Profile with its images, locations and current coordinates to show
+        the swipe card at once, images and locations should be prefetched
+    '''
+    images = ProfileImageSerializer(many=True, read_only=True)
+    location = ProfileLocationSerializer(many=True, read_only=True)
+
+    class Meta(ProfileSerializer.Meta):
+        fields = ProfileSerializer.Meta.fields + ('latitude', 'longitude')
+        read_only_fields = ProfileSerializer.Meta.read_only_fields + ('latitude', 'longitude')
 
 class LocationSerializer(serializers.ModelSerializer):
+    profile = NestedProfileSerializer(read_only=True)
 
     class Meta:
         model = Location
         fields = ('profile', 'location', 'date', 'latitude', 'longitude')
         read_only_fields = ('profile', 'date')
-        depth = 1
\ No newline at end of file
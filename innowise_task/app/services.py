@@ -2,19 +2,38 @@
 import uuid
 import os
 import random
+import logging
 
-from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from django.apps import apps
 from django.conf import settings
+from django.core.cache import cache, caches
+from django.db import transaction, close_old_connections
+from django.db.models import Q, Exists, OuterRef, prefetch_related_objects
 
-from geopy.geocoders import Nominatim
-from geopy.distance import geodesic
+from app.geo import get_bounding_box, get_geohash_cover, within_radius
+from app.geocoding import geocoding_cache, normalize_location, GeocodingPipeline
+
+logger = logging.getLogger(__name__)
+
+feed_refill_executor = ThreadPoolExecutor(max_workers=settings.FEED_QUEUE_REFILL_WORKERS)
 
 def image_file_path(instance, filename) -> str:
-    '''Generate file path for new image'''
-    ext = filename.split('.')[-1]
+    '''
+        Generate file path for new image
+        Image is named by the digest of its contents if it's known
+    '''
+    ext = filename.split('.')[-1].lower()
+    if getattr(instance, 'digest', ''):
+        return os.path.join('upload/profile/', instance.digest[:2], f'{instance.digest}.{ext}')
     filename = f'{uuid.uuid4()}.{ext}'
     return os.path.join('upload/profile/', filename)
 
+def image_derivative_path(instance, filename) -> str:
+    '''Get file path for the scaled down copy of the image'''
+    return os.path.join('upload/profile/derivatives/', filename)
+
 def is_location_update_time_valid(instance) -> bool:
     '''
         Check if it's enough time passed to update 
@@ -27,55 +46,220 @@ def is_location_update_time_valid(instance) -> bool:
 
 def is_profile_updating_self(profile, instance) -> bool:
     '''Check if user updates itself'''
-    return profile == instance
+    return profile.id == instance.id
 
-def is_location_updating_self(instance, profile) -> bool:
+def is_location_updating_self(instance, profile_id) -> bool:
     '''Check if user updates its location'''
-    return instance.profile == profile
+    return instance.profile_id == profile_id
+
+def get_profile_id(user) -> int:
+    '''
+        Get id of the user profile or None if user has no profile
+        Id is kept on the user object for the request and in the cache
+        for AUTHORIZATION_CACHE_TIMEOUT
+    '''
+    if not hasattr(user, '_profile_id'):
+        key = get_profile_id_key(user.id)
+        profile_id = cache.get(key)
+        if profile_id is None:
+            Profile = apps.get_model('app', 'Profile')
+            profile_id = Profile.objects.filter(user=user).values_list('id', flat=True).first()
+            if profile_id is not None:
+                cache.set(key, profile_id, settings.AUTHORIZATION_CACHE_TIMEOUT)
+        user._profile_id = profile_id
+    return user._profile_id
+
+def get_profile_id_key(user_id) -> str:
+    return 'profile_id:{}'.format(user_id)
+
+def invalidate_profile_id(user_id):
+    '''Drop cached profile id of the user when the profile is deleted'''
+    cache.delete(get_profile_id_key(user_id))
 
-def is_info_availbale(obj, profile) -> bool:
+def get_authorization_cache():
+    '''Get cache shared by the processes for match checks or None if they are not cached'''
+    return caches[settings.AUTHORIZATION_CACHE] if settings.AUTHORIZATION_CACHE else None
+
+def get_match_key(profile_id, matched_id) -> str:
+    return 'match:{}:{}'.format(profile_id, matched_id)
+
+def invalidate_matches(pairs):
+    '''
+        Drop cached match checks of the profile pairs in both directions,
+        they are dropped once more on commit in case they were read meanwhile
+    '''
+    shared_cache = get_authorization_cache()
+    if shared_cache is None:
+        return
+    keys = [
+        get_match_key(*pair)
+        for profile_id, matched_id in pairs
+        for pair in ((profile_id, matched_id), (matched_id, profile_id))
+    ]
+    shared_cache.delete_many(keys)
+    transaction.on_commit(lambda: shared_cache.delete_many(keys))
+
+def is_info_availbale(obj_id, profile_id) -> bool:
     '''
         Check if requested user was liked by current user
         and current user was liked by requested user
+        Result is cached in AUTHORIZATION_CACHE for AUTHORIZATION_CACHE_TIMEOUT
     '''
-    user_like = profile.swipes.filter(swiped=obj, liked=True).first()
-    obj_like = obj.swiped.filter(profile=profile, liked=True).first()
-    if user_like and obj_like:
-        return user_like == obj_like
-    return False
+    from activities.models import Match
+    shared_cache = get_authorization_cache()
+    if shared_cache is None:
+        return Match.objects.filter(profile_id=profile_id, matched_id=obj_id).exists()
+    key = get_match_key(profile_id, obj_id)
+    available = shared_cache.get(key)
+    if available is None:
+        available = Match.objects.filter(profile_id=profile_id, matched_id=obj_id).exists()
+        shared_cache.set(key, available, settings.AUTHORIZATION_CACHE_TIMEOUT)
+    return available
 
 def get_coordinates(location) -> tuple:
     '''
         Use geopy lib for getting users geolocation
         User location stored as the name of the country, town etc.
-        Get coordinates using stored user location and 
+        Get coordinates using stored user location, answers of the geocoder
+        are cached so repeated locations don't call it again
+    '''
+    return geocoding_cache.get_coordinates(location)
+
+def get_unchanged_locations(location_ids, location) -> list:
+    '''Get locations which weren't changed since they were queued to be geocoded'''
+    Location = apps.get_model('app', 'Location')
+    return [
+        instance for instance in Location.objects.filter(id__in=location_ids)
+        if normalize_location(instance.location) == normalize_location(location)
+    ]
+
+def save_coordinates(location_ids, location, coordinates):
+    '''
+        Save coordinates geocoded in the background to the locations,
+        skip locations which were changed since they were queued
+    '''
+    for instance in get_unchanged_locations(location_ids, location):
+        instance.latitude, instance.longitude = coordinates
+        instance.save()
+        invalidate_feed(instance.profile_id)
+
+def reset_location_date(location_ids, location):
+    '''
+        Let users update the location which failed to be geocoded in the background
+        at once, previous coordinates are kept until then
+    '''
+    logger.warning('Location %s is not geocoded, its update is allowed again', location)
+    Location = apps.get_model('app', 'Location')
+    Location.objects\
+        .filter(id__in=[instance.id for instance in get_unchanged_locations(location_ids, location)])\
+        .update(date=datetime.now(timezone.utc) - timedelta(hours=settings.LOCATION_UPDATE_HOURS))
+
+geocoding_pipeline = GeocodingPipeline(save_coordinates, reset_location_date)
+
+def get_profiles_around(queryset, coords, radius) -> list:
     '''
-    geolocator = Nominatim(user_agent="InnowiseTaskApp")
-    profile_location = geolocator.geocode(location)
-    return profile_location.latitude, profile_location.longitude
+        Get ids of profiles located in the radius around the coordinates
+        Candidates are prefiltered in the database by the geohash cells and
+        the bounding box of the area, distances to them are calculated at once
+    '''
+    min_lat, max_lat, min_lon, max_lon = get_bounding_box(*coords, radius)
+    area = Q(latitude__range=(min_lat, max_lat))
+    if min_lon is not None:
+        area &= Q(longitude__range=(min_lon, max_lon))
+        cells = Q()
+        for prefix in get_geohash_cover(min_lat, max_lat, min_lon, max_lon):
+            cells |= Q(geohash__startswith=prefix)
+        area &= cells
+
+    candidates = list(queryset\
+        .filter(area)\
+        .values_list('id', 'latitude', 'longitude'))
+    if len(candidates) == 0:
+        return []
+    ids, latitudes, longitudes = zip(*candidates)
+    mask = within_radius(*coords, latitudes, longitudes, radius, exact=settings.GEO_EXACT_DISTANCE)
+    return list({id for id, found in zip(ids, mask) if found})
 
-def get_random_profile(queryset, profile):
+def get_candidates(queryset, profile) -> list:
     '''
         Check whethere people are around the area, specified in user subscription
         and filter already swiped profiles
-        Return random found profile of opposite gender
+        Return ids of found profiles of opposite gender
     '''
-    profile_coords = (profile.location.first().latitude, profile.location.first().longitude)
+    if profile.latitude is None or profile.longitude is None:
+        return []
+    profile_coords = (profile.latitude, profile.longitude)
     radius = settings.VIP_SUBSCRIBTION_RADIUS if profile.vip else settings.BASIC_SUBSCRIPTION_RADIUS
-    swiped_profiles = [swipe.swiped.id for swipe in profile.swipes.all()]
+    swiped = profile.swipes.filter(swiped=OuterRef('pk'))
 
     profiles = queryset\
         .exclude(user=profile.user)\
         .exclude(gender=profile.gender)\
-        .exclude(id__in=swiped_profiles)
-    
-    filtered_profiles = []
-    for profile in profiles:
-        distance = geodesic(profile_coords, (
-            profile.location.first().latitude, 
-            profile.location.first().longitude)
-            )
-        if distance < radius:
-            filtered_profiles.append(profile)
-            
-    return random.choice(filtered_profiles) if len(filtered_profiles) !=0 else None
+        .filter(~Exists(swiped))
+
+    return get_profiles_around(profiles, profile_coords, radius)
+
+def get_feed_cache():
+    '''Get cache shared by the processes for feed queues'''
+    return caches[settings.FEED_CACHE]
+
+def get_feed_key(profile_id) -> str:
+    '''Get cache key of the profile feed queue'''
+    return 'feed:{}'.format(profile_id)
+
+def build_feed(queryset, profile) -> list:
+    '''Scan candidates for the profile and store them shuffled as its feed queue'''
+    candidates = get_candidates(queryset, profile)
+    random.shuffle(candidates)
+    feed = candidates[:settings.FEED_QUEUE_SIZE]
+    get_feed_cache().set(get_feed_key(profile.id), feed, settings.FEED_QUEUE_TIMEOUT)
+    return feed
+
+def refill_feed(queryset, profile):
+    '''Rebuild the feed queue in the worker thread'''
+    try:
+        build_feed(queryset, profile)
+    except Exception:
+        logger.exception('Failed to refill feed of profile %s', profile.id)
+    finally:
+        close_old_connections()
+
+def get_feed_profile(queryset, profile):
+    '''
+        Get next profile from the feed queue of the profile
+        Queue is built when it is empty and refilled in the background
+        after the current transaction is committed when it runs low
+        Profiles swiped since the queue was built are skipped
+    '''
+    feed_cache, key = get_feed_cache(), get_feed_key(profile.id)
+    feed = feed_cache.get(key)
+    if not feed:
+        feed = build_feed(queryset, profile)
+
+    unswiped = queryset.filter(~Exists(profile.swipes.filter(swiped=OuterRef('pk'))))
+    candidate = None
+    while len(feed) != 0 and candidate is None:
+        candidate = unswiped.filter(id=feed.pop(0)).first()
+    feed_cache.set(key, feed, settings.FEED_QUEUE_TIMEOUT)
+
+    if 0 < len(feed) <= settings.FEED_QUEUE_REFILL_THRESHOLD:
+        transaction.on_commit(
+            lambda: feed_refill_executor.submit(refill_feed, queryset.all(), profile)
+        )
+    return candidate
+
+def discard_feed_profile(profile_id, *swiped_ids):
+    '''Remove swiped profiles from the feed queue of the profile'''
+    feed_cache, key = get_feed_cache(), get_feed_key(profile_id)
+    feed = feed_cache.get(key)
+    if feed and not set(feed).isdisjoint(swiped_ids):
+        feed = [id for id in feed if id not in swiped_ids]
+        feed_cache.set(key, feed, settings.FEED_QUEUE_TIMEOUT)
+
+def prefetch_profile_details(profiles):
+    '''Load images and locations of all the profiles by one query each'''
+    prefetch_related_objects(profiles, 'images', 'location')
+
+def invalidate_feed(profile_id):
+    '''Drop the feed queue when the profile search criteria are changed'''
+    get_feed_cache().delete(get_feed_key(profile_id))
@@ -0,0 +1,18 @@
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from app.models import Images, Profile
+from app.services import invalidate_profile_id
+from app.storage import delete_unused_files
+
+@receiver(post_delete, sender=Profile)
+def drop_profile_id(sender, instance, **kwargs):
+    '''Drop cached profile id of the user, including cascade deletes of users'''
+    invalidate_profile_id(instance.user_id)
+
+@receiver(post_delete, sender=Images)
+def delete_image_files(sender, instance, **kwargs):
+    '''Delete files of the image once it is deleted, including cascade deletes of profiles'''
+    names = [instance.image.name, instance.thumbnail.name, instance.feed.name]
+    transaction.on_commit(lambda: delete_unused_files(names, instance.digest))
@@ -0,0 +1,70 @@
+import hashlib
+import os
+import tempfile
+
+from django.apps import apps
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import Q
+from django.utils.deconstruct import deconstructible
+
+def get_file_digest(file) -> str:
+    '''Get SHA-256 of the file contents read by chunks'''
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    '''
+        Storage of files named by their contents
+        File with the taken name already has the same contents, so it is not
+        written again and its name is returned for the new file
+    '''
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        if self.exists(name):
+            return name
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                for chunk in content.chunks():
+                    file.write(chunk)
+            os.chmod(temp_path, self.file_permissions_mode or 0o644)
+            os.replace(temp_path, full_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        return name
+
+content_addressed_storage = ContentAddressedStorage()
+
+def delete_unused_files(names, digest=''):
+    '''
+        Delete stored files unless other images still use them,
+        so files shared by images are deleted with the last one
+        Files of the digest are locked to not delete them while an image
+        with the same contents is saved and skips writing them
+    '''
+    Images = apps.get_model('app', 'Images')
+    ImageContent = apps.get_model('app', 'ImageContent')
+    names = {name for name in names if name}
+    if not names:
+        return
+    with transaction.atomic():
+        if digest:
+            ImageContent.objects.lock(digest)
+        used = Images.objects\
+            .filter(Q(image__in=names) | Q(thumbnail__in=names) | Q(feed__in=names))\
+            .values_list('image', 'thumbnail', 'feed')
+        for name in names - {name for row in used for name in row}:
+            content_addressed_storage.delete(name)
+        if digest and not Images.objects.filter(digest=digest).exists():
+            ImageContent.objects.filter(digest=digest).delete()
@@ -1,12 +1,28 @@
+import io
+import os
 import random
+import time
+
+from urllib.parse import urlparse
 
 from django.urls import reverse
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
 from django.contrib.auth.models import User
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
 from django.conf import settings
+from django.http import UnreadablePostError
+from django.core.cache import cache, caches
 from rest_framework.test import APIClient
 from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
-from app.models import Profile, Location, Images
+from app.models import Profile, Location, Images, ImageContent, ImageUpload
+from activities.models import Swipe
+from app.uploads import UploadConflict, create_upload, append_upload
+from app.geocoding import geocoding_cache, LocationNotFound, GeocodingError, RateLimiter, StubGeocoder
+from app.services import geocoding_pipeline, is_location_update_time_valid
+from app.geo import encode_geohash, get_bounding_box, get_geohash_cover, haversine_distances, within_radius
 from pytest_factoryboy import register
 from factory.django import DjangoModelFactory
 
@@ -14,6 +30,7 @@ import factory
 import pytest
 
 from geopy.geocoders import Nominatim
+from PIL import Image as PILImage
 from geopy.distance import geodesic
 
 @register
@@ -58,6 +75,13 @@ class LocationFactory(DjangoModelFactory):
     longitude = 27.5667
     profile = factory.SubFactory(ProfileFactory)
 
+'''Resolve locations offline'''
+@pytest.fixture
+def stub_geocoder(settings):
+    settings.GEOCODER = 'app.geocoding.StubGeocoder'
+    settings.GEOCODING_STUB_LOCATIONS = {'minsk, belarus': (53.9, 27.5667)}
+    settings.GEOCODING_RATE_LIMIT = None
+
 '''Default API client'''
 @pytest.fixture
 def api_client():
@@ -139,6 +163,9 @@ def test_get_self_profile_info(auth_client):
     response = auth_client.get(url)
     assert response.status_code == 200
 
+    response = auth_client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+    assert response.status_code == 304
+
 '''Get info about unauthorized profile test'''
 @pytest.mark.django_db
 def test_get_self_unauthorized_profile_info(api_client):
@@ -146,6 +173,27 @@ def test_get_self_unauthorized_profile_info(api_client):
     response = api_client.get(url)
     assert response.status_code == 401
 
+'''Get profile id in the token claim and resolve the profile by it'''
+@pytest.mark.django_db
+def test_token_profile_claim(api_client, django_assert_max_num_queries):
+    user: User = UserFactory()
+    user.set_password('secret')
+    user.save()
+    profile: Profile = ProfileFactory(user=user)
+
+    response = api_client.post(reverse('token_obtain_pair'), {'username': user.username, 'password': 'secret'})
+    assert AccessToken(response.data['access'])['profile_id'] == profile.id
+    response = api_client.post(reverse('token_refresh'), {'refresh': response.data['refresh']})
+    assert AccessToken(response.data['access'])['profile_id'] == profile.id
+
+    cache.clear()
+    api_client.credentials(HTTP_AUTHORIZATION=f'Bearer {response.data["access"]}')
+    url = reverse('app:profile-list') + '?me=true'
+    with django_assert_max_num_queries(4) as queries:
+        response = api_client.get(url)
+    assert response.data['id'] == profile.id
+    assert not any('"app_profile"."user_id" =' in query['sql'] for query in queries.captured_queries)
+
 '''Test whether there are no accounts yet'''
 @pytest.mark.django_db
 def test_get_profiles_no_users(auth_client):
@@ -262,3 +310,468 @@ def test_get_random_profile(auth_client):
         )
 
     assert geodesic(user_coords, profile_coords) < radius
+
+@pytest.mark.django_db
+def test_get_random_profile_out_of_radius(auth_client):
+    '''Test whether profiles outside of the subscription radius are not found'''
+    get_profile_url = reverse('app:profile-list') + '?me=true'
+    response = auth_client.get(get_profile_url)
+    user_profile = Profile.objects.get(id=response.data['id'])
+    gender = 'F' if user_profile.gender == 'M' else 'M'
+
+    far_profile: Profile = ProfileFactory(gender=gender)
+    '''Moscow city coordinates'''
+    LocationFactory(profile=far_profile, latitude=55.7558, longitude=37.6173)
+
+    url = reverse('app:profile-list')
+    response = auth_client.get(url)
+    assert response.data['detail'] == 'no users found in the closest area'
+
+    near_profile: Profile = ProfileFactory(gender=gender)
+    LocationFactory(profile=near_profile, latitude=53.92, longitude=27.6)
+
+    response = auth_client.get(url)
+    assert response.data['id'] == near_profile.id
+
+def test_geohash_cover_contains_area_points():
+    '''Test whether geohash cells cover the whole bounding box of the area'''
+    box = get_bounding_box(53.9, 27.5667, settings.VIP_SUBSCRIBTION_RADIUS)
+    cover = get_geohash_cover(*box)
+    min_lat, max_lat, min_lon, max_lon = box
+    for lat in (min_lat, 53.9, max_lat):
+        for lon in (min_lon, 27.5667, max_lon):
+            assert any(encode_geohash(lat, lon).startswith(cell) for cell in cover)
+
+@pytest.mark.parametrize('exact', [False, True])
+def test_within_radius_matches_geodesic(exact):
+    '''Test whether batched distances agree with geodesic distance'''
+    latitudes = [53.9, 53.95, 54.0, 54.2, 55.7558]
+    longitudes = [27.5667, 27.6, 27.7, 27.5667, 37.6173]
+    radius = settings.BASIC_SUBSCRIPTION_RADIUS
+
+    distances = haversine_distances(53.9, 27.5667, latitudes, longitudes)
+    mask = within_radius(53.9, 27.5667, latitudes, longitudes, radius, exact=exact)
+    for i, point in enumerate(zip(latitudes, longitudes)):
+        expected = geodesic((53.9, 27.5667), point).km
+        assert abs(distances[i] - expected) <= expected * 0.005
+        assert mask[i] == (expected < radius)
+
+@pytest.mark.django_db
+def test_feed_queue(auth_client):
+    '''
+        Test whether feed serves every found profile once
+        and swiped profiles are removed from the feed
+    '''
+    get_profile_url = reverse('app:profile-list') + '?me=true'
+    response = auth_client.get(get_profile_url)
+    user_profile = Profile.objects.get(id=response.data['id'])
+    gender = 'F' if user_profile.gender == 'M' else 'M'
+
+    profiles = [ProfileFactory(gender=gender) for i in range(2)]
+    for profile in profiles:
+        LocationFactory(profile=profile)
+
+    url = reverse('app:profile-list')
+    first = auth_client.get(url).data['id']
+    second = auth_client.get(url).data['id']
+    assert {first, second} == {profile.id for profile in profiles}
+
+    response = auth_client.get(url)
+    swiped = response.data['id']
+    response = auth_client.post(reverse('activities:swipe-list'), data={'swiped':swiped, 'liked':False})
+    assert response.status_code == 201
+
+    for i in range(2):
+        response = auth_client.get(url)
+        assert response.data['id'] != swiped
+
+@pytest.mark.django_db
+def test_feed_queue_shared_cache(auth_client, settings):
+    '''
+        Test whether feed queue is kept in FEED_CACHE and profile swiped
+        without the queue being updated, like by another worker, is skipped
+    '''
+    settings.CACHES = dict(settings.CACHES, feed={
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'feed',
+    })
+    settings.FEED_CACHE = 'feed'
+    get_profile_url = reverse('app:profile-list') + '?me=true'
+    user_profile = Profile.objects.get(id=auth_client.get(get_profile_url).data['id'])
+    gender = 'F' if user_profile.gender == 'M' else 'M'
+
+    profiles = [ProfileFactory(gender=gender) for i in range(3)]
+    for profile in profiles:
+        LocationFactory(profile=profile)
+
+    url = reverse('app:profile-list')
+    auth_client.get(url)
+    key = 'feed:{}'.format(user_profile.id)
+    assert cache.get(key) is None
+    feed = caches['feed'].get(key)
+    assert len(feed) == 2
+
+    Swipe.objects.create(profile=user_profile, swiped_id=feed[0], liked=False)
+    assert auth_client.get(url).data['id'] == feed[1]
+    caches['feed'].clear()
+
+@pytest.mark.django_db
+def test_location_syncs_profile_coordinates():
+    '''Test whether profile current coordinates follow its location'''
+    location: Location = LocationFactory()
+    profile = Profile.objects.get(id=location.profile.id)
+    assert (profile.latitude, profile.longitude) == (location.latitude, location.longitude)
+    assert profile.geohash == encode_geohash(location.latitude, location.longitude)
+
+    location.latitude, location.longitude = None, None
+    location.save()
+    profile.refresh_from_db()
+    assert (profile.latitude, profile.longitude, profile.geohash) == (None, None, '')
+
+@pytest.mark.django_db
+def test_geocoding_cache(stub_geocoder):
+    '''Test whether geocoder answers are cached in process and in the database'''
+    assert geocoding_cache.get_coordinates('Minsk, Belarus') == (53.9, 27.5667)
+    assert geocoding_cache.get_coordinates(' minsk,   BELARUS ') == (53.9, 27.5667)
+    assert geocoding_cache.stats == {'hits': 1, 'db_hits': 0, 'misses': 1}
+
+    geocoding_cache.clear()
+    assert geocoding_cache.get_coordinates('Minsk, Belarus') == (53.9, 27.5667)
+    assert geocoding_cache.stats == {'hits': 0, 'db_hits': 1, 'misses': 0}
+
+    for i in range(2):
+        with pytest.raises(LocationNotFound):
+            geocoding_cache.get_coordinates('Atlantis')
+    assert geocoding_cache.stats == {'hits': 1, 'db_hits': 1, 'misses': 1}
+
+@pytest.mark.django_db
+def test_location_update_stub_geocoder(auth_client, stub_geocoder):
+    '''Test whether location update saves coordinates of the found location'''
+    get_profile_url = reverse('app:profile-list') + '?me=true'
+    response = auth_client.get(get_profile_url)
+
+    url = reverse('app:location-detail', kwargs={'pk':response.data['location'][0]})
+    response = auth_client.put(url, data={'location':'Minsk, Belarus'})
+    assert response.status_code == 200
+    assert (response.data['latitude'], response.data['longitude']) == (53.9, 27.5667)
+
+@pytest.mark.django_db
+def test_location_update_async(auth_client, stub_geocoder, settings):
+    '''
+        Test whether location is accepted at once when geocoding is async
+        and identical locations queued together are geocoded once
+    '''
+    settings.GEOCODING_ASYNC = True
+    settings.GEOCODING_WORKERS = 0
+
+    get_profile_url = reverse('app:profile-list') + '?me=true'
+    response = auth_client.get(get_profile_url)
+    location = Location.objects.get(id=response.data['location'][0])
+    other_location: Location = LocationFactory(location='Minsk, Belarus', latitude=None, longitude=None)
+
+    url = reverse('app:location-detail', kwargs={'pk':location.id})
+    response = auth_client.put(url, data={'location':'Minsk, Belarus'})
+    assert response.status_code == 202
+    assert response.data['location'] == 'Minsk, Belarus'
+
+    geocoding_pipeline.submit(other_location.id, 'minsk, belarus')
+    geocoding_pipeline.drain()
+
+    for instance in (location, other_location):
+        instance.refresh_from_db()
+        profile = Profile.objects.get(id=instance.profile_id)
+        assert (instance.latitude, instance.longitude) == (53.9, 27.5667)
+        assert (profile.latitude, profile.longitude) == (53.9, 27.5667)
+    assert geocoding_cache.stats['misses'] == 1
+
+class FlakyGeocoder(StubGeocoder):
+    '''Stub geocoder which is unavailable for the first "failures" calls'''
+    failures = 0
+
+    def geocode(self, location):
+        if FlakyGeocoder.failures > 0:
+            FlakyGeocoder.failures -= 1
+            raise GeocodingError('service is unavailable')
+        return super().geocode(location)
+
+@pytest.mark.django_db
+def test_location_update_async_failures(stub_geocoder, settings):
+    '''
+        Test whether unavailable geocoder is retried in the background and
+        location which is not found keeps its coordinates and can be updated at once
+    '''
+    settings.GEOCODER = 'app.tests.FlakyGeocoder'
+    settings.GEOCODING_WORKERS = 0
+    settings.GEOCODING_RETRY_DELAY = 0
+    location: Location = LocationFactory(location='Minsk, Belarus', latitude=None, longitude=None)
+    FlakyGeocoder.failures = settings.GEOCODING_RETRIES
+    geocoding_pipeline.submit(location.id, location.location)
+    geocoding_pipeline.drain()
+    location.refresh_from_db()
+    assert (location.latitude, location.longitude) == (53.9, 27.5667)
+
+    location.location = 'Atlantis'
+    location.save()
+    assert not is_location_update_time_valid(location)
+    geocoding_pipeline.submit(location.id, location.location)
+    geocoding_pipeline.drain()
+    location.refresh_from_db()
+    assert (location.latitude, location.longitude) == (53.9, 27.5667)
+    assert is_location_update_time_valid(location)
+
+def test_rate_limiter_shared(settings):
+    '''Test whether geocoder calls of different limiters are spaced out by the shared cache'''
+    settings.GEOCODING_RATE_LIMIT = 20
+    limiters = [RateLimiter(), RateLimiter()]
+    start = time.monotonic()
+    for i in range(4):
+        limiters[i % 2].wait()
+    assert time.monotonic() - start >= 3 / 20
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    'filename, content', [
+        pytest.param(
+            'users.jsonl',
+            '{"username": "jane", "password": "secret", "first_name": "Jane", "last_name": "Doe", "email": "jane@example.com"}\n'
+            '{"username": "john", "password": "secret", "first_name": "John", "last_name": "Doe", "email": "john@example.com"}\n'
+            '{"username": "jane", "password": "secret", "first_name": "Jane", "last_name": "Doe", "email": "jane@example.com"}\n'
+            '{"username": "bad", "password": "secret"}\n',
+            id='jsonl'
+            ),
+        pytest.param(
+            'users.csv',
+            'username,password,first_name,last_name,email\n'
+            'jane,secret,Jane,Doe,jane@example.com\n'
+            'john,secret,John,Doe,john@example.com\n'
+            'jane,secret,Jane,Doe,jane@example.com\n'
+            'bad,secret,,,\n',
+            id='csv'
+            )
+    ]
+)
+def test_bulk_register(filename, content, api_client):
+    '''Test whether users, profiles and locations are created from the file'''
+    admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+    api_client.force_authenticate(admin)
+
+    url = reverse('register_bulk')
+    upload = SimpleUploadedFile(filename, content.encode())
+    response = api_client.post(url, data={'file': upload}, format='multipart')
+
+    assert response.status_code == 201
+    assert response.data['created'] == 2
+    assert response.data['skipped'] == 1
+    assert [error['line'] for error in response.data['errors']] == [5 if filename.endswith('csv') else 4]
+    for username in ('jane', 'john'):
+        user = User.objects.get(username=username)
+        assert user.check_password('secret')
+        profile = Profile.objects.get(user=user)
+        assert profile.fname == user.first_name
+        assert Location.objects.filter(profile=profile).count() == 1
+
+@pytest.mark.django_db
+def test_bulk_register_admin_only(auth_client):
+    url = reverse('register_bulk')
+    response = auth_client.post(url, data={}, format='multipart')
+    assert response.status_code == 403
+
+@pytest.mark.django_db
+def test_import_users_command(tmp_path):
+    '''Test whether management command imports users in chunks'''
+    path = tmp_path / 'users.jsonl'
+    path.write_text(''.join(
+        '{{"username": "user{0}", "password": "secret", "first_name": "User", "last_name": "{0}", "email": "user{0}@example.com"}}\n'.format(i)
+        for i in range(5)
+    ))
+    call_command('import_users', str(path), chunk_size=2, workers=1)
+    assert Profile.objects.filter(user__username__startswith='user').count() == 5
+
+def make_image_file(size=(400, 200), orientation=None, name='photo.jpg') -> SimpleUploadedFile:
+    '''Encode JPEG image with EXIF orientation tag'''
+    exif = PILImage.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    output = io.BytesIO()
+    PILImage.new('RGB', size, 'red').save(output, 'JPEG', exif=exif.tobytes())
+    return SimpleUploadedFile(name, output.getvalue(), content_type='image/jpeg')
+
+@pytest.mark.django_db
+def test_image_derivatives(auth_client, settings, tmp_path):
+    '''Test whether uploaded image gets rotated thumbnail and feed copies without EXIF'''
+    settings.MEDIA_ROOT = str(tmp_path)
+    settings.IMAGE_PROCESSING_WORKERS = 0
+
+    response = auth_client.post(
+        reverse('app:images-list'), data={'image': make_image_file(orientation=6)}, format='multipart'
+    )
+    assert response.status_code == 201
+    assert response.data['thumbnail'].endswith('_thumb.webp')
+    assert response.data['feed'].endswith('_feed.webp')
+
+    image = Images.objects.get(id=response.data['id'])
+    with PILImage.open(image.image.path) as original:
+        assert original.size == (200, 400)
+        assert 0x0112 not in original.getexif()
+    with PILImage.open(image.thumbnail.path) as thumbnail:
+        assert thumbnail.format == 'WEBP'
+        assert thumbnail.size == settings.IMAGE_THUMBNAIL_SIZE
+    with PILImage.open(image.feed.path) as feed:
+        assert feed.size == (200, 400)
+        assert 0x0112 not in feed.getexif()
+
+    Images.objects.filter(id=image.id).update(thumbnail='', feed='')
+    call_command('process_images')
+    assert Images.objects.get(id=image.id).feed
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('limits', [{'IMAGE_UPLOAD_MAX_SIZE': 100}, {'IMAGE_UPLOAD_MAX_DIMENSIONS': (300, 300)}])
+def test_image_upload_limits(limits, auth_client, settings, tmp_path):
+    '''Test whether too large images are rejected while they are uploaded'''
+    settings.MEDIA_ROOT = str(tmp_path)
+    for name, value in limits.items():
+        setattr(settings, name, value)
+    response = auth_client.post(
+        reverse('app:images-list'), data={'image': make_image_file()}, format='multipart'
+    )
+    assert response.status_code == 413
+    assert not Images.objects.exists()
+
+@pytest.mark.django_db
+def test_resumable_image_upload(auth_client, settings, tmp_path):
+    '''Test whether image uploaded in chunks is saved once all the chunks are received'''
+    settings.MEDIA_ROOT = str(tmp_path / 'media')
+    settings.IMAGE_UPLOAD_PARTIAL_DIR = str(tmp_path / 'partial')
+    settings.IMAGE_PROCESSING_WORKERS = 0
+    content = make_image_file().read()
+    half = len(content) // 2
+
+    response = auth_client.post(
+        reverse('app:image-upload-list'), data={'filename': 'photo.jpg', 'size': len(content)}
+    )
+    assert response.status_code == 201
+    url = reverse('app:image-upload-detail', kwargs={'pk': response.data['id']})
+
+    def send(chunk, offset):
+        return auth_client.generic(
+            'PATCH', url, chunk, content_type='application/offset+octet-stream', HTTP_UPLOAD_OFFSET=str(offset)
+        )
+
+    assert send(content[:half], 0).data['offset'] == half
+    response = send(content[half:], 0)
+    assert response.status_code == 409
+    assert response.data['offset'] == half
+    assert auth_client.get(url).data['offset'] == half
+
+    response = send(content[half:], half)
+    assert response.status_code == 201
+    image = Images.objects.get(id=response.data['id'])
+    with PILImage.open(image.image) as original:
+        assert original.size == (400, 200)
+    assert image.feed
+    assert auth_client.get(url).status_code == 404
+
+@pytest.mark.django_db(transaction=True)
+def test_image_deduplication(auth_client, settings, tmp_path):
+    '''Test whether images with the same contents share files deleted with the last image'''
+    settings.MEDIA_ROOT = str(tmp_path)
+    settings.IMAGE_PROCESSING_WORKERS = 0
+    content = make_image_file().read()
+
+    ids = [
+        auth_client.post(
+            reverse('app:images-list'),
+            data={'image': SimpleUploadedFile(name, content, content_type='image/jpeg')},
+            format='multipart'
+        ).data['id']
+        for name in ('photo.png', 'copy.jpeg')
+    ]
+    first, second = Images.objects.filter(id__in=ids).order_by('id')
+    assert first.digest and first.digest == second.digest
+    assert first.image.name.endswith(first.digest + '.jpg')
+    assert (first.image.name, first.thumbnail.name, first.feed.name) \
+        == (second.image.name, second.thumbnail.name, second.feed.name)
+    paths = [first.image.path, first.thumbnail.path, first.feed.path]
+    assert len(list(tmp_path.rglob('*.*'))) == 3
+
+    first.delete()
+    assert all(os.path.exists(path) for path in paths)
+    second.delete()
+    assert not any(os.path.exists(path) for path in paths)
+    assert not ImageContent.objects.exists()
+
+@pytest.mark.django_db
+def test_conditional_images(auth_client, settings, tmp_path):
+    '''Test whether unchanged images and their files are answered with 304 Not Modified'''
+    settings.MEDIA_ROOT = str(tmp_path)
+    settings.IMAGE_PROCESSING_WORKERS = 0
+    response = auth_client.post(
+        reverse('app:images-list'), data={'image': make_image_file()}, format='multipart'
+    )
+    detail = reverse('app:images-detail', kwargs={'pk': response.data['id']})
+
+    for url in (reverse('app:images-list'), detail):
+        response = auth_client.get(url)
+        assert response.status_code == 200
+        assert auth_client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code == 304
+
+    url = urlparse(response.data['feed']).path
+    response = auth_client.get(url)
+    assert response.status_code == 200
+    assert 'immutable' in response['Cache-Control']
+    assert b''.join(response.streaming_content) == Images.objects.get().feed.read()
+    assert auth_client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code == 304
+    assert auth_client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code == 304
+
+    settings.MEDIA_SENDFILE = 'x-accel-redirect'
+    response = auth_client.get(url)
+    assert response['X-Accel-Redirect'] == settings.MEDIA_SENDFILE_URL + url[len(settings.MEDIA_URL):]
+    assert response.content == b''
+    assert auth_client.get(settings.MEDIA_URL + '../manage.py').status_code == 404
+
+@pytest.mark.django_db
+def test_expanded_profile(auth_client):
+    '''Test whether expanded profile embeds images and locations with a fixed number of queries'''
+    url = reverse('app:profile-list') + '?me=true&expand=true'
+    profile = Profile.objects.get(id=auth_client.get(url).data['id'])
+    Images.objects.create(profile=profile, image='upload/profile/first.jpg')
+    with CaptureQueriesContext(connection) as one_image:
+        auth_client.get(url)
+    for i in range(3):
+        Images.objects.create(profile=profile, image='upload/profile/{}.jpg'.format(i))
+    with CaptureQueriesContext(connection) as many_images:
+        response = auth_client.get(url)
+    assert len(one_image) == len(many_images)
+    assert len(response.data['images']) == 4
+    assert response.data['images'][0]['thumbnail'].endswith('/media/upload/profile/first.jpg')
+    assert response.data['location'][0]['id'] == profile.location.get().id
+    assert 'latitude' in response.data
+
+    gender = 'F' if profile.gender == 'M' else 'M'
+    candidate = ProfileFactory(gender=gender)
+    LocationFactory(profile=candidate)
+    Images.objects.create(profile=candidate, image='upload/profile/candidate.jpg')
+    response = auth_client.get(reverse('app:profile-list') + '?expand=true')
+    assert response.data['id'] == candidate.id
+    assert response.data['images'][0]['feed'].endswith('candidate.jpg')
+
+@pytest.mark.django_db
+def test_interrupted_image_upload(auth_client, settings, tmp_path):
+    '''Test whether bytes received before the client is disconnected are kept'''
+    settings.IMAGE_UPLOAD_PARTIAL_DIR = str(tmp_path)
+    content = make_image_file().read()
+    profile_id = auth_client.get(reverse('app:profile-list') + '?me=true').data['id']
+    upload = create_upload(profile_id, 'photo.jpg', len(content))
+
+    class DisconnectedStream(io.BytesIO):
+        def read(self, size=-1):
+            data = super().read(size)
+            if not data:
+                raise UnreadablePostError('client is disconnected')
+            return data
+
+    with pytest.raises(UnreadablePostError):
+        append_upload(upload, DisconnectedStream(content[:100]), 0, len(content))
+    assert ImageUpload.objects.get(id=upload.id).offset == 100
+    with pytest.raises(UploadConflict):
+        append_upload(upload, io.BytesIO(content), 0, len(content))
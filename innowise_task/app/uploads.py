@@ -0,0 +1,202 @@
+
+import fcntl
+import os
+import time
+
+from datetime import datetime, timedelta, timezone
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files import File
+from django.core.files.uploadhandler import FileUploadHandler
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotFound
+
+from PIL import Image, ImageFile
+
+'''Bytes of the file checked for the image header, multipart bytes allowed besides the file'''
+HEADER_MAX_SIZE = 256 * 1024
+MULTIPART_OVERHEAD = 64 * 1024
+CHUNK_SIZE = 64 * 1024
+
+class ImageTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'image is too large'
+    default_code = 'image_too_large'
+
+class InvalidImage(APIException):
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_detail = 'upload a valid image'
+    default_code = 'invalid_image'
+
+class UploadConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'upload should be resumed from the offset'
+    default_code = 'upload_conflict'
+
+    def __init__(self, offset, detail=None):
+        super().__init__(detail)
+        self.offset = offset
+
+def check_dimensions(size):
+    '''Raise ImageTooLarge if the image is bigger than IMAGE_UPLOAD_MAX_DIMENSIONS'''
+    max_width, max_height = settings.IMAGE_UPLOAD_MAX_DIMENSIONS
+    if size[0] > max_width or size[1] > max_height:
+        raise ImageTooLarge('image dimensions should be no more than {}x{}'.format(max_width, max_height))
+
+class ImageHeaderChecker:
+    '''
+        Parse image header from the chunks of the file as they arrive
+        and check image dimensions as soon as they are known
+        Files without a known header in the first HEADER_MAX_SIZE bytes
+        are left to the image validation
+    '''
+
+    def __init__(self):
+        self.parser = ImageFile.Parser()
+        self.received = 0
+        self.done = False
+
+    def feed(self, data):
+        if self.done:
+            return
+        self.received += len(data)
+        try:
+            self.parser.feed(data)
+        except Exception:
+            self.done = True
+            return
+        if self.parser.image is not None:
+            self.done = True
+            check_dimensions(self.parser.image.size)
+        elif self.received >= HEADER_MAX_SIZE:
+            self.done = True
+
+class ImageUploadHandler(FileUploadHandler):
+    '''
+        Check uploaded image while the request body is read
+        Upload is stopped with 413 as soon as the file exceeds IMAGE_UPLOAD_MAX_SIZE
+        or its header shows dimensions over IMAGE_UPLOAD_MAX_DIMENSIONS,
+        chunks are passed on to the default handlers writing them to the file
+    '''
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        if content_length > settings.IMAGE_UPLOAD_MAX_SIZE + MULTIPART_OVERHEAD:
+            raise ImageTooLarge()
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.size = 0
+        self.checker = ImageHeaderChecker()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.size += len(raw_data)
+        if self.size > settings.IMAGE_UPLOAD_MAX_SIZE:
+            raise ImageTooLarge()
+        self.checker.feed(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+def get_partial_path(upload) -> str:
+    '''Get path of the partially uploaded file'''
+    return os.path.join(settings.IMAGE_UPLOAD_PARTIAL_DIR, str(upload.id))
+
+def delete_expired_uploads():
+    '''Delete unfinished uploads and partial files older than IMAGE_UPLOAD_SESSION_TIMEOUT'''
+    ImageUpload = apps.get_model('app', 'ImageUpload')
+    timeout = settings.IMAGE_UPLOAD_SESSION_TIMEOUT
+    ImageUpload.objects.filter(date__lt=datetime.now(timezone.utc) - timedelta(seconds=timeout)).delete()
+    if not os.path.isdir(settings.IMAGE_UPLOAD_PARTIAL_DIR):
+        return
+    with os.scandir(settings.IMAGE_UPLOAD_PARTIAL_DIR) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.stat().st_mtime < time.time() - timeout:
+                os.remove(entry.path)
+
+def create_upload(profile_id, filename, size):
+    '''Start resumable upload of the image of the declared size'''
+    if size > settings.IMAGE_UPLOAD_MAX_SIZE:
+        raise ImageTooLarge()
+    delete_expired_uploads()
+    ImageUpload = apps.get_model('app', 'ImageUpload')
+    upload = ImageUpload.objects.create(profile_id=profile_id, filename=filename, size=size)
+    os.makedirs(settings.IMAGE_UPLOAD_PARTIAL_DIR, exist_ok=True)
+    open(get_partial_path(upload), 'wb').close()
+    return upload
+
+def append_upload(upload, stream, offset, length):
+    '''
+        Write chunk of the length read from the stream in pieces at the offset
+        Partial file is locked while the chunk is written, the offset is moved
+        by the conditional update without a transaction kept open for the read
+        Bytes received before the client is disconnected are kept,
+        so the upload is resumed from the last received byte
+    '''
+    ImageUpload = apps.get_model('app', 'ImageUpload')
+    path = get_partial_path(upload)
+    with open(path, 'r+b') as file:
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadConflict(upload.offset, 'chunk of the upload is being received')
+        upload.offset = ImageUpload.objects.filter(id=upload.id).values_list('offset', flat=True).first()
+        if upload.offset is None:
+            raise NotFound()
+        if offset != upload.offset:
+            raise UploadConflict(upload.offset)
+        if offset + length > upload.size:
+            raise ImageTooLarge('chunk exceeds the declared upload size')
+        file.truncate(offset)
+        file.seek(offset)
+        remaining = length
+        try:
+            while remaining > 0:
+                data = stream.read(min(CHUNK_SIZE, remaining))
+                if not data:
+                    break
+                file.write(data)
+                remaining -= len(data)
+        finally:
+            file.flush()
+            upload.offset = offset + length - remaining
+            ImageUpload.objects.filter(id=upload.id, offset=offset).update(offset=upload.offset)
+
+    if offset < HEADER_MAX_SIZE:
+        checker = ImageHeaderChecker()
+        with open(path, 'rb') as file:
+            checker.feed(file.read(HEADER_MAX_SIZE))
+
+def complete_upload(upload):
+    '''
+        Save completely uploaded file as the profile image and finish the upload
+        Upload is deleted first, so it is completed by one request only
+    '''
+    Images = apps.get_model('app', 'Images')
+    ImageUpload = apps.get_model('app', 'ImageUpload')
+    path = get_partial_path(upload)
+    if not ImageUpload.objects.filter(id=upload.id).delete()[0]:
+        raise NotFound()
+    try:
+        try:
+            with Image.open(path) as image:
+                check_dimensions(image.size)
+                image.verify()
+        except ImageTooLarge:
+            raise
+        except Exception:
+            raise InvalidImage()
+        with open(path, 'rb') as file:
+            image = Images(profile_id=upload.profile_id, image=File(file, name=upload.filename))
+            image.save()
+    finally:
+        os.remove(path)
+    return image
+
+def cancel_upload(upload):
+    '''Delete unfinished upload with its partial file'''
+    path = get_partial_path(upload)
+    upload.delete()
+    if os.path.exists(path):
+        os.remove(path)
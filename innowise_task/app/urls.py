@@ -7,6 +7,7 @@ app_name = 'app'
 
 router = DefaultRouter()
 
+router.register('images/upload', views.ImageUploadViewSet, basename='image-upload')
 router.register('images', views.ImagesViewSet)
 router.register('profile', views.ProfileViewSet)
 router.register('location', views.LocationViewSet)
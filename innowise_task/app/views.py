@@ -1,21 +1,49 @@
-from django.shortcuts import render
+from django.shortcuts import render, get_object_or_404
+from django.conf import settings
+from django.views.decorators.http import require_safe
 from rest_framework import generics, viewsets, mixins
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
+from rest_framework.parsers import MultiPartParser
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 
 import os
 
-from app.models import Profile, Images, Location
-from app.serializers import ProfileSerializer, UserSerializer, ImagesSerializer, LocationSerializer
+from app.models import Profile, Images, Location, ImageUpload
+from app.serializers import (
+    ProfileSerializer,
+    ExpandedProfileSerializer,
+    UserSerializer,
+    ImagesSerializer,
+    LocationSerializer,
+    ImageUploadSerializer
+)
 from app.services import (
     is_location_update_time_valid, 
     is_profile_updating_self, 
     is_location_updating_self,
     is_info_availbale,
-    get_random_profile,
-    get_coordinates
+    get_profile_id,
+    get_feed_profile,
+    invalidate_feed,
+    prefetch_profile_details,
+    get_coordinates,
+    geocoding_pipeline
+)
+from app.geocoding import LocationNotFound, GeocodingError
+from app.registration import import_users_file
+from app.images import schedule_image_processing
+from app.conditional import conditional_response, media_response
+from app.uploads import (
+    ImageUploadHandler,
+    ImageTooLarge,
+    InvalidImage,
+    UploadConflict,
+    create_upload,
+    append_upload,
+    complete_upload,
+    cancel_upload
 )
 
 from os.path import join, dirname
@@ -27,23 +55,31 @@ class ProfileViewSet(viewsets.GenericViewSet,
     serializer_class = ProfileSerializer
     permission_classes = (IsAuthenticated, )
     queryset = Profile.objects.all()
-        
+
+    def is_expanded(self) -> bool:
+        '''Check if images, locations and coordinates are requested with "expand" param'''
+        return self.request.query_params.get('expand', '').lower() in ('true', '1')
+
+    def get_serializer_class(self):
+        return ExpandedProfileSerializer if self.is_expanded() else ProfileSerializer
+
+    def get_serializer(self, instance=None, *args, **kwargs):
+        '''Get serializer with related objects of the expanded profile loaded at once'''
+        if instance is not None and self.is_expanded():
+            prefetch_profile_details(instance if kwargs.get('many') else [instance])
+        return super().get_serializer(instance, *args, **kwargs)
+
     def list(self, request):
         '''Get current authenticated user by checking params'''
-        if request.GET:
-            return Response(
-                self.get_serializer(
-                    self.queryset.filter(user=self.request.user).first()
-                ).data
+        if set(request.GET) - {'expand'}:
+            return conditional_response(
+                request, self.get_serializer(request.profile).data
             ) if 'me' in request.GET else Response(status=status.HTTP_400_BAD_REQUEST)
 
         '''Get random user around current user to like or dislike it'''
-        profile = get_random_profile(
-            self.get_queryset(), 
-            self.queryset.filter(user=self.request.user).first()
-            )
+        profile = get_feed_profile(self.get_queryset(), request.profile)
         if profile:
-            serializer = self.get_serializer(self.get_queryset().filter(user=profile.user).first())
+            serializer = self.get_serializer(profile)
             return Response(serializer.data)
         message = {'detail':'no users found in the closest area'}
         return Response(message, status=status.HTTP_200_OK)
@@ -51,11 +87,13 @@ class ProfileViewSet(viewsets.GenericViewSet,
     def update(self, request, pk):
         '''Update profile if user updates itself'''
         instance = self.get_object()
-        profile = self.queryset.filter(user=self.request.user).first()
-        if is_profile_updating_self(instance, profile):
+        if is_profile_updating_self(instance, request.profile):
             serializer = self.get_serializer(instance, data=request.data)
             if serializer.is_valid():
+                vip, gender = instance.vip, instance.gender
                 serializer.save()
+                if (vip, gender) != (instance.vip, instance.gender):
+                    invalidate_feed(instance.id)
                 return Response(serializer.data, status=status.HTTP_200_OK)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -65,10 +103,9 @@ class ProfileViewSet(viewsets.GenericViewSet,
     def retrieve(self, request, pk):
         '''Get profile info if users are matched'''
         instance = self.get_object()
-        profile = self.queryset.filter(user=self.request.user).first()
-        if is_info_availbale(instance, profile):
+        if is_info_availbale(instance.id, get_profile_id(request.user)):
             serializer = self.get_serializer(instance)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            return conditional_response(request, serializer.data)
         message = {'detail':'user can\'t get info about unmatched profile'}
         return Response(message, status=status.HTTP_400_BAD_REQUEST)
         
@@ -81,8 +118,10 @@ class LocationViewSet(viewsets.GenericViewSet,
 
     def list(self, request):
         '''Get current authenticated user location'''
-        profile = Profile.objects.get(user=self.request.user)
-        serializer = self.get_serializer(self.get_queryset().filter(profile=profile).first())
+        location = self.get_queryset()\
+            .filter(profile_id=get_profile_id(request.user))\
+            .first()
+        serializer = self.get_serializer(location)
         return Response(serializer.data)
 
     def update(self, request, pk):
@@ -91,26 +130,42 @@ class LocationViewSet(viewsets.GenericViewSet,
             calculate coordinates according to user location
         '''
         instance = self.get_object()
-        profile = Profile.objects.get(user=self.request.user)
-        if is_location_updating_self(instance, profile):
+        profile_id = get_profile_id(request.user)
+        if is_location_updating_self(instance, profile_id):
             if is_location_update_time_valid(instance):
-                try:
-                    lat, lon = get_coordinates(request.data['location'])
+                if 'location' not in request.data:
+                    message = {'detail':'please, specify the location'}
+                    return Response(message, status=status.HTTP_400_BAD_REQUEST)
+                if settings.GEOCODING_ASYNC:
+                    '''Save location now, coordinates are updated when it is geocoded'''
                     serializer = self.get_serializer(instance, data={
                         'location': request.data['location'],
-                        'latitude': float(lat),
-                        'longitude': float(lon)
+                        'latitude': instance.latitude,
+                        'longitude': instance.longitude
                     })
                     if serializer.is_valid():
                         serializer.save()
-                        return Response(serializer.data, status=status.HTTP_200_OK)
+                        geocoding_pipeline.submit(instance.id, instance.location)
+                        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
                     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-                except:
-                    if 'location' in request.data:
-                        message = {'detail':'try another location'}
-                    else:
-                        message = {'detail':'please, specify the location'}
+                try:
+                    lat, lon = get_coordinates(request.data['location'])
+                except LocationNotFound:
+                    message = {'detail':'try another location'}
                     return Response(message, status=status.HTTP_400_BAD_REQUEST)
+                except GeocodingError:
+                    message = {'detail':'geocoding service is unavailable, try again later'}
+                    return Response(message, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+                serializer = self.get_serializer(instance, data={
+                    'location': request.data['location'],
+                    'latitude': float(lat),
+                    'longitude': float(lon)
+                })
+                if serializer.is_valid():
+                    serializer.save()
+                    invalidate_feed(profile_id)
+                    return Response(serializer.data, status=status.HTTP_200_OK)
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
             message = {'detail':'location update available only once every two hours'}
             return Response(message, status=status.HTTP_400_BAD_REQUEST)
         message = {'detail':'user can update only its location'}
@@ -124,17 +179,102 @@ class ImagesViewSet(viewsets.GenericViewSet,
     serializer_class = ImagesSerializer
     permission_classes = (IsAuthenticated, )
     queryset = Images.objects.all()
+    lookup_value_regex = '[0-9]+'
 
     def list(self, request):
         """Return images for current authenticated user only"""
-        profile = Profile.objects.get(user=request.user)
-        serializer = self.get_serializer(self.get_queryset().filter(profile=profile), many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        profile_id = get_profile_id(request.user)
+        serializer = self.get_serializer(self.get_queryset().filter(profile_id=profile_id), many=True)
+        return conditional_response(request, serializer.data)
+
+    def retrieve(self, request, *args, **kwargs):
+        """Return image, 304 Not Modified if the client has the same one"""
+        return conditional_response(request, self.get_serializer(self.get_object()).data)
+
+    def create(self, request, *args, **kwargs):
+        """Upload image, too large images are rejected before they are read completely"""
+        request.upload_handlers.insert(0, ImageUploadHandler(request))
+        return super().create(request, *args, **kwargs)
 
     def perform_create(self, serializer):
-        """Add new image"""
-        profile = Profile.objects.get(user=self.request.user)
-        serializer.save(profile=profile)
+        """Add new image, thumbnail and feed copies are generated in background"""
+        image = serializer.save(profile_id=get_profile_id(self.request.user))
+        schedule_image_processing(image)
+
+class ImageUploadViewSet(viewsets.ViewSet):
+    permission_classes = (IsAuthenticated, )
+    lookup_value_regex = '[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}'
+
+    def get_upload(self, request, pk):
+        uploads = ImageUpload.objects.filter(profile_id=get_profile_id(request.user))
+        return get_object_or_404(uploads, id=pk)
+
+    def create(self, request):
+        '''Start resumable upload of the image with its file name and size in bytes'''
+        serializer = ImageUploadSerializer(data=request.data)
+        if serializer.is_valid():
+            try:
+                upload = create_upload(
+                    get_profile_id(request.user),
+                    serializer.validated_data['filename'],
+                    serializer.validated_data['size']
+                )
+            except ImageTooLarge as e:
+                return Response({'detail': e.detail}, status=e.status_code)
+            return Response(ImageUploadSerializer(upload).data, status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    def retrieve(self, request, pk):
+        '''Get offset to resume the upload from'''
+        upload = self.get_upload(request, pk)
+        return Response(ImageUploadSerializer(upload).data, status=status.HTTP_200_OK)
+
+    def partial_update(self, request, pk):
+        '''
+            Write chunk sent in the body at the offset given in "Upload-Offset" header
+            Image is saved when all the declared bytes are received
+        '''
+        upload = self.get_upload(request, pk)
+        try:
+            offset = int(request.headers['Upload-Offset'])
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except (KeyError, ValueError):
+            message = {'detail':'please, specify the \"Upload-Offset\" header'}
+            return Response(message, status=status.HTTP_400_BAD_REQUEST)
+        if offset + length > upload.size:
+            message = {'detail':'chunk exceeds the declared upload size'}
+            return Response(message, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        try:
+            append_upload(upload, request.stream, offset, length)
+        except UploadConflict as e:
+            message = {'detail': e.detail, 'offset': e.offset}
+            return Response(message, status=e.status_code)
+        except ImageTooLarge as e:
+            cancel_upload(upload)
+            return Response({'detail': e.detail}, status=e.status_code)
+        if upload.offset < upload.size:
+            return Response(ImageUploadSerializer(upload).data, status=status.HTTP_200_OK)
+        try:
+            image = complete_upload(upload)
+        except (ImageTooLarge, InvalidImage) as e:
+            return Response({'detail': e.detail}, status=e.status_code)
+        schedule_image_processing(image)
+        serializer = ImagesSerializer(image, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def destroy(self, request, pk):
+        '''Cancel the upload'''
+        cancel_upload(self.get_upload(request, pk))
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+@require_safe
+def serve_media(request, path):
+    '''
+        Serve uploaded file, names of the stored files are never reused for other
+        contents so their URLs are cached as immutable by browsers and CDNs
+    '''
+    return media_response(request, path)
 
 class UserView(APIView):
     permission_classes = (AllowAny, )
@@ -157,6 +297,23 @@ class UserView(APIView):
                 return Response(json, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+class BulkUserView(APIView):
+    permission_classes = (IsAdminUser, )
+    parser_classes = (MultiPartParser, )
+
+    def post(self, request):
+        """Register users from the uploaded JSON lines or CSV file"""
+        if 'file' not in request.FILES:
+            message = {'detail':'please, upload the file with users'}
+            return Response(message, status=status.HTTP_400_BAD_REQUEST)
+        format = request.data.get('format')
+        if format not in (None, 'jsonl', 'csv'):
+            message = {'detail':'file format should be jsonl or csv'}
+            return Response(message, status=status.HTTP_400_BAD_REQUEST)
+        upload = request.FILES['file']
+        result = import_users_file(upload.file, upload.name, format)
+        return Response(result, status=status.HTTP_201_CREATED)
+
 class APIOverview(APIView):
     permission_classes = (AllowAny, )
 
@@ -171,10 +328,16 @@ class APIOverview(APIView):
             'register/':{
                 'POST':'Register new user, credentials are provided'
             },
+            'register/bulk/':{
+                'POST':'Register users from uploaded JSON lines or CSV file, admin only'
+            },
             'api/app/':{
                 'profile?me=true':{
                     'GET':'Get info about current authenticated profile'
                 },
+                'profile?expand=true':{
+                    'GET':'Get profile with its image URLs, locations and coordinates, works with "me" and {pk} too'
+                },
                 'profile/':{
                     'GET':'Get random profile of opposite gender and near the user',
                     'GET {pk}':'Get info about profile only if current user is matched with requested user',
@@ -188,12 +351,21 @@ class APIOverview(APIView):
                     'GET':'Get images of current authenticated user',
                     'GET {pk}':'Get image specified in request',
                     'POST':'Save new image for current user'
+                },
+                'images/upload/':{
+                    'POST':'Start resumable upload of an image',
+                    'GET {pk}':'Get offset to resume the upload from',
+                    'PATCH {pk}':'Send next chunk of the image',
+                    'DELETE {pk}':'Cancel the upload'
                 }
             },
             'api/activities/':{
                 'swipe/':{
                     'GET':'Get list of matches for current user',
                     'POST':'Create a swipe object when user makes swipe',
+                },
+                'swipe/batch/':{
+                    'POST':'Create swipes user made offline at once',
                 }
             },
             'api/chat/':{
@@ -202,6 +374,12 @@ class APIOverview(APIView):
                     'GET {pk}':'Get messages from a chat specified in the request',
                     'POST':'Send new message to a chat',
                 }
+            },
+            'media/{path}':{
+                'GET':'Get uploaded file, cached as immutable'
+            },
+            'ws/chat/{pk}/?token={access}':{
+                'WS':'Receive new messages of a chat in real time'
             }
         }
         return Response(endpoints, status=status.HTTP_200_OK)
@@ -0,0 +1,35 @@
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+
+from app.services import get_profile_id
+from chat.services import is_chat_available, get_chat_group
+
+class ChatConsumer(AsyncJsonWebsocketConsumer):
+    '''
+        Push new messages of the chat to the connected participants
+        Connection is closed if user is not authenticated or not in the chat
+    '''
+
+    async def connect(self):
+        self.group = get_chat_group(self.scope['url_route']['kwargs']['pk'])
+        if not await self.is_participant():
+            await self.close()
+            return
+        await self.channel_layer.group_add(self.group, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code):
+        await self.channel_layer.group_discard(self.group, self.channel_name)
+
+    async def receive_json(self, content, **kwargs):
+        '''Messages are sent with POST api/chat/chat/, socket is read-only'''
+
+    async def chat_message(self, event):
+        await self.send_json({'type': 'message', 'message': event['message']})
+
+    @database_sync_to_async
+    def is_participant(self) -> bool:
+        user = self.scope['user']
+        if not user.is_authenticated:
+            return False
+        return is_chat_available(get_profile_id(user), self.scope['url_route']['kwargs']['pk'])
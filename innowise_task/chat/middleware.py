@@ -0,0 +1,29 @@
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.contrib.auth.models import AnonymousUser
+from rest_framework_simplejwt.exceptions import InvalidToken, AuthenticationFailed
+
+from app.authentication import ProfileJWTAuthentication
+
+@database_sync_to_async
+def get_user(token):
+    '''Get user of the access token or anonymous user if token is invalid'''
+    authentication = ProfileJWTAuthentication()
+    try:
+        return authentication.get_user(authentication.get_validated_token(token))
+    except (InvalidToken, AuthenticationFailed):
+        return AnonymousUser()
+
+class JWTAuthMiddleware(BaseMiddleware):
+    '''
+        Authenticate websocket connections with the access token
+        passed in "token" query param, browsers can't set headers on websockets
+    '''
+
+    async def __call__(self, scope, receive, send):
+        query = parse_qs(scope.get('query_string', b'').decode())
+        token = query.get('token')
+        scope = dict(scope, user=await get_user(token[0]) if token else AnonymousUser())
+        return await super().__call__(scope, receive, send)
@@ -0,0 +1,17 @@
+# Generated by Django 3.1.6 on 2026-10-18 10:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_message_message'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['chat', 'date', 'id'], name='chat_messag_chat_id_6c6182_idx'),
+        ),
+    ]
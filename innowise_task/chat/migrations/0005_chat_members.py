@@ -0,0 +1,81 @@
+# Generated by Django 3.1.6 on 2026-10-18 10:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.db.models.expressions
+from django.db.models import F
+
+
+def canonicalize_chats(apps, schema_editor):
+    Chat = apps.get_model('chat', 'Chat')
+    ChatMember = apps.get_model('chat', 'ChatMember')
+    Message = apps.get_model('chat', 'Message')
+    Chat.objects.filter(user1__gt=F('user2')).update(
+        user1=F('user2'),
+        user2=F('user1'),
+        user1_unread=F('user2_unread'),
+        user2_unread=F('user1_unread')
+    )
+
+    duplicates = Chat.objects\
+        .values('user1', 'user2')\
+        .annotate(count=models.Count('id'))\
+        .filter(count__gt=1)
+    for pair in duplicates:
+        chats = list(Chat.objects.filter(user1=pair['user1'], user2=pair['user2']).order_by('id'))
+        chat, merged = chats[0], chats[1:]
+        Message.objects.filter(chat__in=merged).update(chat=chat)
+        last_message = Message.objects.filter(chat=chat).order_by('-date', '-id').first()
+        Chat.objects.filter(id=chat.id).update(
+            last_message=last_message,
+            last_activity=last_message.date if last_message else chat.last_activity,
+            user1_unread=sum(merged_chat.user1_unread for merged_chat in chats),
+            user2_unread=sum(merged_chat.user2_unread for merged_chat in chats)
+        )
+        Chat.objects.filter(id__in=[merged_chat.id for merged_chat in merged]).delete()
+
+    ChatMember.objects.bulk_create([
+        ChatMember(chat_id=id, profile_id=profile_id)
+        for id, user1_id, user2_id in Chat.objects.values_list('id', 'user1_id', 'user2_id').iterator()
+        for profile_id in (user1_id, user2_id)
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_geocodedlocation'),
+        ('chat', '0004_chat_last_message'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatMember',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='chatmember',
+            name='chat',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='members', to='chat.chat'),
+        ),
+        migrations.AddField(
+            model_name='chatmember',
+            name='profile',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='app.profile'),
+        ),
+        migrations.AddConstraint(
+            model_name='chatmember',
+            constraint=models.UniqueConstraint(fields=('profile', 'chat'), name='unique_chat_member'),
+        ),
+        migrations.RunPython(canonicalize_chats, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='chat',
+            constraint=models.UniqueConstraint(fields=('user1', 'user2'), name='unique_chat'),
+        ),
+        migrations.AddConstraint(
+            model_name='chat',
+            constraint=models.CheckConstraint(check=models.Q(user1__lt=django.db.models.expressions.F('user2')), name='chat_user_order'),
+        ),
+    ]
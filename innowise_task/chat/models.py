@@ -1,7 +1,64 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import Case, When, F, Q
+from django.utils import timezone
 from app.models import Profile
 
+def get_participants_key(chat_id) -> str:
+    return 'chat_participants:{}'.format(chat_id)
+
+class ChatManager(models.Manager):
+
+    def get_pair(self, profile_id, other_id):
+        '''
+            Get chat of two profiles, it is created if they don't have one yet
+            None is returned for the profile itself
+        '''
+        return self.get_pairs(profile_id, [other_id]).get(other_id)
+
+    def create_pair(self, profile_id, other_id):
+        '''
+            Create chat of two profiles matched just now along with its members,
+            chat is looked up by get_pair only if they already have one
+        '''
+        try:
+            with transaction.atomic():
+                return self.create(user1_id=profile_id, user2_id=other_id)
+        except IntegrityError:
+            return self.get_pair(profile_id, other_id)
+
+    def get_pairs(self, profile_id, other_ids) -> dict:
+        '''
+            Get chats of the profile with every other profile by their id,
+            missing chats are created with their members,
+            the profile itself is skipped as it can't chat with itself
+        '''
+        other_ids = [other_id for other_id in other_ids if other_id != profile_id]
+        pairs = {
+            other_id: (min(profile_id, other_id), max(profile_id, other_id))
+            for other_id in other_ids
+        }
+        self.bulk_create([
+            Chat(user1_id=user1_id, user2_id=user2_id) for user1_id, user2_id in pairs.values()
+        ], ignore_conflicts=True)
+        chats = {
+            (chat.user1_id, chat.user2_id): chat
+            for chat in self.filter(
+                Q(user1_id=profile_id, user2_id__in=other_ids) |
+                Q(user2_id=profile_id, user1_id__in=other_ids)
+            )
+        }
+        ChatMember.objects.bulk_create([
+            ChatMember(chat=chat, profile_id=member_id)
+            for chat in chats.values() for member_id in (chat.user1_id, chat.user2_id)
+        ], ignore_conflicts=True)
+        return {other_id: chats[pair] for other_id, pair in pairs.items()}
+
 class Chat(models.Model):
+    '''
+        Chat of two matched profiles, profile with the lower id is always user1
+        so that every pair has one chat, participants are listed in ChatMember
+        to find chats of the profile by one index
+    '''
     user1 = models.ForeignKey(
         Profile, 
         on_delete=models.CASCADE,
@@ -16,6 +73,45 @@ class Chat(models.Model):
 
     date = models.DateTimeField(auto_now_add=True)
 
+    last_message = models.ForeignKey(
+        'Message',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+
+    last_activity = models.DateTimeField(default=timezone.now)
+
+    user1_unread = models.PositiveIntegerField(default=0)
+    user2_unread = models.PositiveIntegerField(default=0)
+
+    objects = ChatManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user1', 'user2'], name='unique_chat'),
+            models.CheckConstraint(check=Q(user1__lt=F('user2')), name='chat_user_order'),
+        ]
+
+    def save(self, *args, **kwargs):
+        '''Save chat with participants in canonical order, members are added to the new chat'''
+        if self.user1_id > self.user2_id:
+            self.user1_id, self.user2_id = self.user2_id, self.user1_id
+            self.user1_unread, self.user2_unread = self.user2_unread, self.user1_unread
+        adding = self._state.adding
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+            if adding:
+                ChatMember.objects.bulk_create([
+                    ChatMember(chat=self, profile_id=self.user1_id),
+                    ChatMember(chat=self, profile_id=self.user2_id),
+                ])
+
+    def get_unread(self, profile_id) -> int:
+        '''Get number of messages the participant hasn't read yet'''
+        return self.user1_unread if profile_id == self.user1_id else self.user2_unread
+
     def __str__(self):
         return 'Chat {}: {} {} - {} {}'.format(
             self.id, 
@@ -23,6 +119,25 @@ class Chat(models.Model):
             self.user2.fname, self.user2.lname
         )
 
+class ChatMember(models.Model):
+    '''Participant of the chat, stored once for each of the two profiles'''
+    chat = models.ForeignKey(
+        Chat,
+        on_delete=models.CASCADE,
+        related_name='members'
+    )
+
+    profile = models.ForeignKey(
+        Profile,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['profile', 'chat'], name='unique_chat_member'),
+        ]
+
 class Message(models.Model):
     message = models.CharField(max_length=300)
     sender = models.ForeignKey(
@@ -37,6 +152,36 @@ class Message(models.Model):
 
     date = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['chat', 'date', 'id']),
+        ]
+
+    def save(self, *args, **kwargs):
+        '''
+            Save message and make it the last one of the chat
+            Unread counter of the other participant is incremented
+            Chat.DoesNotExist is raised if the chat is already deleted
+        '''
+        adding = self._state.adding
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+            if adding:
+                updated = Chat.objects.filter(id=self.chat_id).update(
+                    last_message=self,
+                    last_activity=self.date,
+                    user1_unread=Case(
+                        When(user1_id=self.sender_id, then=F('user1_unread')),
+                        default=F('user1_unread') + 1
+                    ),
+                    user2_unread=Case(
+                        When(user2_id=self.sender_id, then=F('user2_unread')),
+                        default=F('user2_unread') + 1
+                    )
+                )
+                if not updated:
+                    raise Chat.DoesNotExist('chat {} does not exist'.format(self.chat_id))
+
     def __str__(self):
         return 'Message from {} {} to chat {}'.format(
             self.sender.fname, self.sender.lname, self.chat
@@ -1,18 +1,56 @@
 from rest_framework import serializers
 
+from app.models import Profile
+from app.serializers import NestedProfileSerializer
 from chat.models import Chat, Message
 
-class ChatSerializer(serializers.ModelSerializer):
-       
+class CompactProfileSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = Profile
+        fields = ('id', 'fname', 'lname', 'info', 'vip', 'gender', )
+
+class CompactMessageSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = Message
+        fields = ('id', 'message', 'sender', 'chat', 'date', )
+
+class ChatPreviewMixin(serializers.Serializer):
+    '''Last message and unread count of the profile given in "profile_id" context'''
+    last_message = CompactMessageSerializer(read_only=True)
+    unread = serializers.SerializerMethodField()
+
+    def get_unread(self, chat) -> int:
+        profile_id = self.context.get('profile_id')
+        return chat.get_unread(profile_id) if profile_id else None
+
+class ChatSerializer(ChatPreviewMixin, serializers.ModelSerializer):
+    user1 = NestedProfileSerializer(read_only=True)
+    user2 = NestedProfileSerializer(read_only=True)
+
     class Meta:
         model = Chat
-        fields = ('id', 'user1', 'user2', )
-        read_only_fields = ('user1', 'user2', )
-        depth = 1
+        fields = ('id', 'user1', 'user2', 'last_message', 'last_activity', 'unread', )
 
 class MessageSerializer(serializers.ModelSerializer):
+    sender = NestedProfileSerializer(read_only=True)
 
     class Meta:
         model = Message
         fields = ('id', 'message', 'sender', 'chat', )
-        depth = 1
\ No newline at end of file
+        depth = 1
+
+class CompactChatSerializer(ChatPreviewMixin, serializers.ModelSerializer):
+
+    class Meta:
+        model = Chat
+        fields = ('id', 'user1', 'user2', 'date', 'last_message', 'last_activity', 'unread', )
+
+def get_profiles_map(profiles) -> dict:
+    '''Serialize profiles once each to the map by profile id'''
+    unique = {profile.id: profile for profile in profiles}
+    return {
+        str(id): CompactProfileSerializer(profile).data
+        for id, profile in unique.items()
+    }
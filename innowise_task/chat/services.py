@@ -1,4 +1,82 @@
+import base64
 
-def is_chat_available(profile, chat) -> bool:
+from datetime import datetime
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+
+from chat.models import Chat, Message, get_participants_key
+from chat.serializers import CompactMessageSerializer
+
+def get_chat_participants(chat_id) -> tuple:
+    '''
+        Get profile ids of the chat participants, empty if chat doesn't exist
+        Participants of the chat never change, they are cached for
+        AUTHORIZATION_CACHE_TIMEOUT and dropped when the chat is deleted
+    '''
+    key = get_participants_key(chat_id)
+    participants = cache.get(key)
+    if participants is None:
+        participants = Chat.objects.filter(id=chat_id).values_list('user1_id', 'user2_id').first()
+        if participants is None:
+            return ()
+        cache.set(key, participants, settings.AUTHORIZATION_CACHE_TIMEOUT)
+    return participants
+
+def is_chat_available(profile_id, chat_id) -> bool:
     '''Check if user is a participant of current chat'''
-    return chat.user1 == profile or chat.user2 == profile
\ No newline at end of file
+    return profile_id is not None and profile_id in get_chat_participants(chat_id)
+
+def mark_chat_read(profile_id, chat_id):
+    '''Reset unread counter of the participant, nothing is written if it's already zero'''
+    field = 'user1_unread' if profile_id == get_chat_participants(chat_id)[0] else 'user2_unread'
+    Chat.objects.filter(id=chat_id, **{field + '__gt': 0}).update(**{field: 0})
+
+def get_chat_group(chat_id) -> str:
+    '''Get name of the channel layer group of the chat websockets'''
+    return 'chat_{}'.format(chat_id)
+
+def broadcast_message(message):
+    '''Push message to the websockets of the chat once it is committed'''
+    data = dict(CompactMessageSerializer(message).data)
+    transaction.on_commit(lambda: async_to_sync(get_channel_layer().group_send)(
+        get_chat_group(message.chat_id), {'type': 'chat.message', 'message': data}
+    ))
+
+def encode_cursor(message) -> str:
+    '''Get cursor pointing to the position of the message in the chat history'''
+    position = '{}|{}'.format(message.date.isoformat(), message.id)
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+def decode_cursor(cursor) -> tuple:
+    '''Get date and id of the message the cursor points to, raise ValueError if invalid'''
+    date, id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+    return datetime.fromisoformat(date), int(id)
+
+def get_messages_page(chat_id, limit, cursor=None, since=None) -> tuple:
+    '''
+        Get page of chat messages from the newest to the oldest using keyset on (date, id)
+        Messages older than the cursor are returned, or the oldest messages
+        newer than since cursor if it is given to fetch only new messages
+        Return messages, cursor of the next older page and cursor of the newest message
+    '''
+    messages = Message.objects.filter(chat_id=chat_id).select_related('sender', 'chat')
+    if since:
+        date, id = decode_cursor(since)
+        page = list(messages\
+            .filter(Q(date__gt=date) | Q(date=date, id__gt=id))\
+            .order_by('date', 'id')[:limit])
+        page.reverse()
+        return page, None, encode_cursor(page[0]) if page else since
+
+    if cursor:
+        date, id = decode_cursor(cursor)
+        messages = messages.filter(Q(date__lt=date) | Q(date=date, id__lt=id))
+    page = list(messages.order_by('-date', '-id')[:limit + 1])
+    next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+    page = page[:limit]
+    return page, next_cursor, encode_cursor(page[0]) if page else None
@@ -0,0 +1,10 @@
+from django.core.cache import cache
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from chat.models import Chat, get_participants_key
+
+@receiver(post_delete, sender=Chat)
+def drop_chat_participants(sender, instance, **kwargs):
+    '''Drop cached participants of the chat, including cascade deletes of profiles'''
+    cache.delete(get_participants_key(instance.id))
@@ -4,16 +4,21 @@ from django.urls import reverse
 from django.contrib.auth.models import User
 from django.test import TestCase
 from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError
 from rest_framework.test import APIClient
 from pytest_factoryboy import register
 from factory.django import DjangoModelFactory
 from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.testing import WebsocketCommunicator
 
 from app.tests import ProfileFactory, UserFactory, LocationFactory
 from app.models import Profile, Location, Images
 from activities.models import Swipe
 from activities.tests import SwipeFactory
-from chat.models import Chat, Message
+from chat.models import Chat, Message, get_participants_key
+from innowise_task.asgi import application
 
 import factory
 import pytest
@@ -149,6 +154,29 @@ def test_send_message_to_wrong_chat(auth_client):
     assert response.status_code == 400
     assert response.data['detail'] == 'user can\'t chat with unmatched users'
 
+@pytest.mark.django_db
+def test_send_message_to_deleted_chat(auth_client):
+    '''Chat deleted with the other participant or behind the cache can't get messages'''
+    url = reverse('app:profile-list') + '?me=true'
+    user_profile = Profile.objects.get(id=auth_client.get(url).data['id'])
+    profile: Profile = ProfileFactory(gender='F')
+    chat: Chat = ChatFactory(user1=user_profile, user2=profile)
+
+    url = reverse('chat:chat-list')
+    data = {'chat':chat.id, 'message':'Hello world!'}
+    assert auth_client.post(url, data=data).status_code == 201
+
+    profile.user.delete()
+    response = auth_client.post(url, data=data)
+    assert response.status_code == 400
+    assert not Message.objects.exists()
+
+    other = ProfileFactory()
+    cache.set(get_participants_key(chat.id), (user_profile.id, other.id))
+    response = auth_client.post(url, data=data)
+    assert response.status_code == 400
+    assert response.data['detail'] == 'pleace, specify the \"chat\" field'
+
 @pytest.mark.django_db
 def test_get_messages_from_chat(auth_client):
     '''Get messages from user specified chat test'''
@@ -192,3 +220,163 @@ def test_get_messages_from_wrong_chat(auth_client):
     assert response.status_code == 400
     assert response.data['detail'] == 'user can\'t get messages from a chat he is not in'
 
+
+@pytest.mark.django_db
+def test_get_messages_pages(auth_client):
+    '''Test whether chat history is paginated by cursor and new messages are fetched since cursor'''
+    url = reverse('app:profile-list') + '?me=true'
+    response = auth_client.get(url)
+    user_profile = Profile.objects.get(id=response.data['id'])
+
+    chat: Chat = ChatFactory(user1=user_profile, user2=ProfileFactory())
+    messages = [MessageFactory(sender=user_profile, chat=chat) for i in range(5)]
+
+    url = reverse('chat:chat-detail', kwargs={'pk':chat.id})
+    ids = []
+    response = auth_client.get(url, {'limit': 2})
+    since = response['X-Since-Cursor']
+    while True:
+        ids += [message['id'] for message in response.data]
+        if 'X-Next-Cursor' not in response:
+            break
+        response = auth_client.get(url, {'limit': 2, 'cursor': response['X-Next-Cursor']})
+    assert ids == [message.id for message in reversed(messages)]
+
+    response = auth_client.get(url, {'since': since})
+    assert response.data == []
+    assert response['X-Since-Cursor'] == since
+
+    new_messages = [MessageFactory(sender=user_profile, chat=chat) for i in range(3)]
+    response = auth_client.get(url, {'since': since, 'limit': 2})
+    assert [message['id'] for message in response.data] == [new_messages[1].id, new_messages[0].id]
+    response = auth_client.get(url, {'since': response['X-Since-Cursor']})
+    assert [message['id'] for message in response.data] == [new_messages[2].id]
+
+    response = auth_client.get(url, {'cursor': 'invalid'})
+    assert response.status_code == 400
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('params', [{}, {'compact': 'true'}])
+def test_get_messages_queries(params, auth_client, django_assert_max_num_queries):
+    '''Test whether chat list and history take the same number of queries for any size'''
+    url = reverse('app:profile-list') + '?me=true'
+    response = auth_client.get(url)
+    user_profile = Profile.objects.get(id=response.data['id'])
+
+    for i in range(3):
+        profile: Profile = ProfileFactory()
+        chat: Chat = ChatFactory(user1=user_profile, user2=profile)
+        for j in range(4):
+            MessageFactory(sender=profile if j % 2 else user_profile, chat=chat)
+
+    with django_assert_max_num_queries(3):
+        response = auth_client.get(reverse('chat:chat-list'), params)
+    with django_assert_max_num_queries(4):
+        response = auth_client.get(reverse('chat:chat-detail', kwargs={'pk':chat.id}), params)
+    with django_assert_max_num_queries(3):
+        response = auth_client.get(reverse('chat:chat-detail', kwargs={'pk':chat.id}), params)
+
+    if params:
+        assert len(response.data['messages']) == 4
+        assert set(response.data['profiles']) == {str(user_profile.id), str(profile.id)}
+        assert response.data['messages'][0]['sender'] in (user_profile.id, profile.id)
+    else:
+        assert len(response.data) == 4
+
+@pytest.mark.django_db
+def test_chat_pairs_are_canonical():
+    '''Test if pair of profiles has one chat with the lower profile id as user1'''
+    profile: Profile = ProfileFactory()
+    other: Profile = ProfileFactory()
+    chat: Chat = ChatFactory(user1=other, user2=profile)
+
+    assert (chat.user1_id, chat.user2_id) == (profile.id, other.id)
+    assert Chat.objects.get_pair(other.id, profile.id) == chat
+    assert set(chat.members.values_list('profile_id', flat=True)) == {profile.id, other.id}
+    assert list(Chat.objects.filter(members__profile=other)) == [chat]
+
+    new = ProfileFactory()
+    chats = Chat.objects.get_pairs(profile.id, [other.id, new.id])
+    assert chats[other.id] == chat
+    assert chats[new.id].user2_id == new.id
+    assert Chat.objects.filter(members__profile=profile).count() == 2
+
+    assert Chat.objects.create_pair(other.id, profile.id) == chat
+    newest = ProfileFactory()
+    created = Chat.objects.create_pair(newest.id, profile.id)
+    assert (created.user1_id, created.user2_id) == (profile.id, newest.id)
+    assert set(created.members.values_list('profile_id', flat=True)) == {profile.id, newest.id}
+    with pytest.raises(IntegrityError):
+        Chat.objects.create(user1=profile, user2=other)
+
+@pytest.mark.django_db
+def test_get_chats_previews(auth_client):
+    '''Test if chats are sorted by last activity with last message and unread count'''
+    url = reverse('app:profile-list') + '?me=true'
+    response = auth_client.get(url)
+    user_profile = Profile.objects.get(id=response.data['id'])
+
+    chats = [ChatFactory(user1=user_profile) for i in range(3)]
+    MessageFactory(sender=chats[0].user2, chat=chats[0])
+    last_message = MessageFactory(sender=chats[0].user2, chat=chats[0])
+    MessageFactory(sender=user_profile, chat=chats[1])
+
+    response = auth_client.get(reverse('chat:chat-list'))
+    assert [chat['id'] for chat in response.data] == [chats[1].id, chats[0].id, chats[2].id]
+    assert response.data[1]['last_message']['id'] == last_message.id
+    assert [chat['unread'] for chat in response.data] == [0, 2, 0]
+    assert response.data[2]['last_message'] is None
+
+    auth_client.get(reverse('chat:chat-detail', kwargs={'pk':chats[0].id}))
+    chats[0].refresh_from_db()
+    assert chats[0].get_unread(user_profile.id) == 0
+    assert chats[0].get_unread(chats[0].user2_id) == 0
+
+    response = auth_client.get(reverse('chat:chat-list'), {'compact': 'true'})
+    assert [chat['unread'] for chat in response.data['chats']] == [0, 0, 0]
+
+@pytest.mark.django_db(transaction=True)
+def test_chat_socket_receives_new_messages():
+    '''Test if new message is pushed to the websocket of the chat participant'''
+    sender: Profile = ProfileFactory()
+    receiver: Profile = ProfileFactory()
+    chat: Chat = ChatFactory(user1=sender, user2=receiver)
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(sender.user).access_token}')
+    token = RefreshToken.for_user(receiver.user).access_token
+
+    async def receive():
+        communicator = WebsocketCommunicator(application, f'/ws/chat/{chat.id}/?token={token}')
+        connected, _ = await communicator.connect()
+        assert connected
+        response = await sync_to_async(client.post)(
+            reverse('chat:chat-list'), data={'chat': chat.id, 'message': 'hello'}
+        )
+        assert response.status_code == 201
+        event = await communicator.receive_json_from()
+        await communicator.disconnect()
+        return event
+
+    event = async_to_sync(receive)()
+    assert event['type'] == 'message'
+    assert event['message']['message'] == 'hello'
+    assert event['message']['sender'] == sender.id
+    assert event['message']['chat'] == chat.id
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize('authenticated', [False, True])
+def test_chat_socket_rejects_strangers(authenticated):
+    '''Test if websocket is closed for anonymous users and users not in the chat'''
+    chat: Chat = ChatFactory()
+    stranger: Profile = ProfileFactory()
+    path = f'/ws/chat/{chat.id}/'
+    if authenticated:
+        path += f'?token={RefreshToken.for_user(stranger.user).access_token}'
+
+    async def connect():
+        communicator = WebsocketCommunicator(application, path)
+        connected, _ = await communicator.connect()
+        await communicator.disconnect()
+        return connected
+
+    assert async_to_sync(connect)() is False
@@ -1,5 +1,6 @@
 from django.shortcuts import render
-from django.db.models import Q
+from django.conf import settings
+from django.db import transaction
 
 from rest_framework import generics, viewsets, mixins
 from rest_framework.permissions import IsAuthenticated, AllowAny
@@ -8,49 +9,108 @@ from rest_framework.response import Response
 from rest_framework import status
 
 from chat.models import Chat, Message
-from chat.serializers import ChatSerializer, MessageSerializer
-from chat.services import is_chat_available
-from app.models import Profile
+from chat.serializers import (
+    ChatSerializer,
+    MessageSerializer,
+    CompactChatSerializer,
+    CompactMessageSerializer,
+    get_profiles_map
+)
+from chat.services import (
+    is_chat_available,
+    get_chat_participants,
+    get_messages_page,
+    broadcast_message,
+    mark_chat_read
+)
+from app.services import get_profile_id
 
 class ChatViewSet(viewsets.ViewSet):
     permission_classes = (IsAuthenticated, )
+    lookup_value_regex = '[0-9]+'
 
     def list(self, request):
         '''
             Get a list of chats available for current user
             Can chat only with matched users
+            Chats are sorted by last activity, last message and unread count are included
+            With "compact" param participants are sent once in "profiles" map
         '''
-        profile = Profile.objects.get(user=request.user)
+        profile_id = get_profile_id(request.user)
         chats = Chat.objects.filter(
-            Q(user1=profile) | Q(user2=profile)
-        )
-        serializer = ChatSerializer(chats, many=True)
+            members__profile_id=profile_id
+        ).select_related('user1', 'user2', 'last_message').order_by('-last_activity', '-id')
+        context = {'profile_id': profile_id}
+        if 'compact' in request.GET:
+            return Response({
+                'chats': CompactChatSerializer(chats, many=True, context=context).data,
+                'profiles': get_profiles_map(
+                    user for chat in chats for user in (chat.user1, chat.user2)
+                )
+            }, status=status.HTTP_200_OK)
+        serializer = ChatSerializer(chats, many=True, context=context)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     def create(self, request):
-        '''Send new message to chat'''
-        profile = Profile.objects.get(user=request.user)
+        '''
+            Send new message to chat
+            Message is pushed to the chat websockets as well
+            Participants may come from the cache, so the chat deleted meanwhile
+            is detected when the message is saved
+        '''
+        profile_id = get_profile_id(request.user)
         serializer = MessageSerializer(data=request.data)
         try:
-            chat = Chat.objects.get(id=request.data['chat'])
-        except:
+            chat_id = int(request.data['chat'])
+        except (KeyError, TypeError, ValueError):
+            chat_id = None
+        if chat_id is None or not get_chat_participants(chat_id):
             message = {'detail':'pleace, specify the \"chat\" field'}
             return Response(message, status=status.HTTP_400_BAD_REQUEST)
         if serializer.is_valid():
-            if is_chat_available(profile, chat):
-                serializer.save(sender=profile, chat=chat)
+            if is_chat_available(profile_id, chat_id):
+                try:
+                    with transaction.atomic():
+                        broadcast_message(serializer.save(sender_id=profile_id, chat_id=chat_id))
+                except Chat.DoesNotExist:
+                    message = {'detail':'pleace, specify the \"chat\" field'}
+                    return Response(message, status=status.HTTP_400_BAD_REQUEST)
                 return Response(serializer.data, status=status.HTTP_201_CREATED)
             message = {'detail':'user can\'t chat with unmatched users'}
             return Response(message, status=status.HTTP_400_BAD_REQUEST)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def retrieve(self, request, pk):
-        '''Get all messages from the specified chat'''
-        profile = Profile.objects.get(user=request.user)
-        chat = Chat.objects.get(id=pk)
-        if is_chat_available(profile, chat):
-            messages = Message.objects.filter(chat_id=pk).order_by('-date')
-            serializer = MessageSerializer(messages, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+        '''
+            Get messages from the specified chat, newest first
+            Page of messages older than "cursor" or newer than "since" is returned,
+            cursors of the next page and of the newest message are sent in headers,
+            unread messages of the chat are marked as read
+            With "compact" param senders are sent once in "profiles" map
+        '''
+        profile_id = get_profile_id(request.user)
+        if is_chat_available(profile_id, pk):
+            try:
+                limit = min(int(request.GET.get('limit', settings.CHAT_MESSAGES_PAGE_SIZE)), settings.CHAT_MESSAGES_MAX_PAGE_SIZE)
+                messages, next_cursor, since_cursor = get_messages_page(
+                    pk, max(limit, 1), request.GET.get('cursor'), request.GET.get('since')
+                )
+            except ValueError:
+                message = {'detail':'invalid cursor or limit'}
+                return Response(message, status=status.HTTP_400_BAD_REQUEST)
+            mark_chat_read(profile_id, pk)
+            if 'compact' in request.GET:
+                response = Response({
+                    'messages': CompactMessageSerializer(messages, many=True).data,
+                    'profiles': get_profiles_map(message.sender for message in messages)
+                }, status=status.HTTP_200_OK)
+            else:
+                serializer = MessageSerializer(messages, many=True)
+                response = Response(serializer.data, status=status.HTTP_200_OK)
+            if next_cursor:
+                response['X-Next-Cursor'] = next_cursor
+            if since_cursor:
+                response['X-Since-Cursor'] = since_cursor
+            return response
         message = {'detail':'user can\'t get messages from a chat he is not in'}
         return Response(message, status=status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,11 @@
+from django.core.cache import cache
+
+from app.geocoding import geocoding_cache
+
+import pytest
+
+'''Clear cached feeds, authorization checks and geocoded locations between the tests'''
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    geocoding_cache.clear()
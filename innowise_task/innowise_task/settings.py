@@ -44,6 +44,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'rest_framework',
+    'channels',
     'app',
     'activities',
     'chat'
@@ -78,6 +79,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'innowise_task.wsgi.application'
+ASGI_APPLICATION = 'innowise_task.asgi.application'
 
 
 # Database
@@ -137,13 +139,66 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 MEDIA_URL = '/media/'
 
+'''Seconds media files are cached for, stored files are never changed so they are cached as immutable'''
+MEDIA_CACHE_MAX_AGE = 365 * 24 * 60 * 60
+
+'''
+    Web server sending media files instead of Django: None, "x-accel-redirect"
+    for nginx serving MEDIA_ROOT at internal MEDIA_SENDFILE_URL or "x-sendfile"
+'''
+MEDIA_SENDFILE = None
+MEDIA_SENDFILE_URL = '/protected/media/'
+
+'''Thumbnails are cut to the size, feed images fit in it, both are stored in WEBP or JPEG'''
+IMAGE_THUMBNAIL_SIZE = (160, 160)
+IMAGE_FEED_SIZE = (720, 960)
+IMAGE_DERIVATIVE_FORMAT = 'WEBP'
+IMAGE_DERIVATIVE_QUALITY = 80
+
+'''Quality of the uploaded JPEG images encoded again without EXIF'''
+IMAGE_ORIGINAL_QUALITY = 95
+
+'''Max size in bytes and dimensions of uploaded images, uploads are stopped as soon as they exceed them'''
+IMAGE_UPLOAD_MAX_SIZE = 10 * 1024 * 1024
+IMAGE_UPLOAD_MAX_DIMENSIONS = (6000, 6000)
+
+'''Directory of partially uploaded images and seconds to keep unfinished uploads'''
+IMAGE_UPLOAD_PARTIAL_DIR = os.path.join(BASE_DIR, 'uploads')
+IMAGE_UPLOAD_SESSION_TIMEOUT = 24 * 60 * 60
+
+'''Worker threads generating image derivatives, 0 to generate them during the upload'''
+IMAGE_PROCESSING_WORKERS = 2
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+'''Seconds to cache profile ids of users, chat participants and matches checked on every request'''
+AUTHORIZATION_CACHE_TIMEOUT = 5 * 60
+
+'''
+    Cache alias for match checks, it must be shared by all the processes, like Redis
+    or memcached one, so that a withdrawn like is seen by every worker at once
+    Match checks are not cached if it is None
+'''
+AUTHORIZATION_CACHE = None
+
+'''Layer delivering chat messages to websockets, in-memory one works within one process'''
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+    }
+}
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISIION_CLASSES': (
         'rest_framework.permissions.AllowAny',
     ),
 
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'app.authentication.ProfileJWTAuthentication',
     )
 }
 
@@ -177,8 +232,62 @@ SIMPLE_JWT = {
 
 LOCATION_UPDATE_HOURS = 2
 
+'''Bulk registration, passwords are hashed in the pool of worker processes'''
+BULK_IMPORT_CHUNK_SIZE = 1000
+BULK_IMPORT_WORKERS = os.cpu_count() or 1
+
+'''Geocoder used to get coordinates of the location, StubGeocoder works offline'''
+GEOCODER = 'app.geocoding.NominatimGeocoder'
+GEOCODING_TIMEOUT = 5
+GEOCODING_STUB_LOCATIONS = {}
+
+'''Geocoder answers cache, TTL is in seconds'''
+GEOCODING_CACHE_SIZE = 1024
+GEOCODING_CACHE_TTL = 30 * 24 * 60 * 60
+GEOCODING_NEGATIVE_CACHE_TTL = 24 * 60 * 60
+
+'''
+    Max geocoder calls per second, Nominatim usage policy allows one
+    Calls are counted in the cache alias, which must be shared by all the processes,
+    like Redis or memcached one, for the limit to hold for all of them
+'''
+GEOCODING_RATE_LIMIT = 1
+GEOCODING_RATE_LIMIT_CACHE = 'default'
+
+'''Accept location updates at once and geocode them in the worker threads'''
+GEOCODING_ASYNC = False
+GEOCODING_WORKERS = 2
+GEOCODING_BATCH_SIZE = 20
+GEOCODING_BATCH_WAIT = 0.1
+
+'''Background geocoding retries while geocoder is unavailable, delays double from seconds given'''
+GEOCODING_RETRIES = 3
+GEOCODING_RETRY_DELAY = 1
+
 BASIC_SUBSCRIPTION_RADIUS = 10
 VIP_SUBSCRIBTION_RADIUS = 25
 
+'''Check profiles near the radius border with geodesic instead of spherical distance'''
+GEO_EXACT_DISTANCE = False
+
+'''Precomputed queue of candidates served one at a time on the profile feed'''
+FEED_QUEUE_SIZE = 100
+FEED_QUEUE_REFILL_THRESHOLD = 5
+FEED_QUEUE_REFILL_WORKERS = 2
+FEED_QUEUE_TIMEOUT = 60 * 60
+
+'''
+    Cache alias for feed queues, it must be shared by all the processes, like Redis
+    or memcached one, otherwise every worker serves its own queue of the profile
+'''
+FEED_CACHE = 'default'
+
 BASIC_SUBSCRIPTION_SWIPES = 20
 VIP_SUBSCRIBTION_SWIPES = 100
+
+'''Max number of swipes sent to the batch endpoint at once'''
+SWIPE_BATCH_SIZE = 100
+
+'''Number of chat messages returned at once'''
+CHAT_MESSAGES_PAGE_SIZE = 50
+CHAT_MESSAGES_MAX_PAGE_SIZE = 200